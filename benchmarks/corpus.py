@@ -0,0 +1,68 @@
+"""
+Corpus of model outputs for the benchmarks.
+
+By default the corpus is synthesized deterministically from a hint dataset:
+for every problem it produces outputs in the shapes small models actually
+return (answer tag, \\boxed{} with nested braces, a wrong answer, no answer
+at all, a long rambling derivation, more text after the answer), so
+extraction, grading and streaming cut-off see a realistic mix of cases.
+A JSONL file of recorded outputs with "question", "truth" and "output"
+fields can be used instead.
+"""
+import os
+import random
+
+from elis.pipeline import iter_jsonl
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "omnimath_100_with_hints_v2.jsonl")
+
+FILLER = (
+    "Let us work through the problem step by step. First we restate what is given "
+    "and what is asked, then we apply the hint. "
+)
+AFTERTHOUGHT = "Let me double-check this by going over each step again. "
+
+
+def _wrong(truth, rng):
+    digits = [c for c in truth if c.isdigit()]
+    if digits:
+        d = rng.choice(digits)
+        return truth.replace(d, str((int(d) + rng.randint(1, 8)) % 10), 1)
+    return rng.choice(["0", "1", "x+1", "\\frac{1}{2}"])
+
+
+def _outputs_for(truth, rng):
+    reasoning = FILLER * rng.randint(1, 6)
+    # Small models often keep going after they have answered.
+    rambling = AFTERTHOUGHT * rng.randint(5, 30)
+    return [
+        f"{reasoning}\nSo the final answer is <answer>{truth}</answer>.\n{rambling}",
+        f"{reasoning}\nTherefore the answer is $\\boxed{{{truth}}}$.\n{rambling}",
+        f"{reasoning}\n<answer> {truth} </answer>\nDouble-checking: $\\boxed{{{truth}}}$",
+        f"{reasoning}\nThe answer is <answer>{_wrong(truth, rng)}</answer>.\n{rambling}",
+        f"{reasoning}\nI could not finish the computation in time.",
+        f"{FILLER * rng.randint(20, 40)}\nSo we get $\\boxed{{\\frac{{{_wrong(truth, rng)}}}{{1}}}}$",
+        f"<answer>{truth}</answer>",
+        f"{reasoning}\nAnswer: <answer>\\text{{{_wrong(truth, rng)}}}</answer>",
+    ]
+
+
+def build_corpus(dataset_path=DEFAULT_DATASET, samples_per_problem=8, seed=0):
+    """Returns a list of {"question", "truth", "output"} records synthesized from a hint dataset."""
+    rng = random.Random(seed)
+    corpus = []
+    for _, record in iter_jsonl(dataset_path):
+        truth = record.get("final_answer_gt")
+        if not record.get("question") or truth is None:
+            continue
+        outputs = _outputs_for(str(truth), rng)
+        for i in range(samples_per_problem):
+            corpus.append({"question": record["question"], "truth": str(truth), "output": outputs[i % len(outputs)]})
+    return corpus
+
+
+def load_corpus(path=None, **kwargs):
+    """Loads recorded outputs from a JSONL file, or synthesizes the default corpus if path is None."""
+    if path is None:
+        return build_corpus(**kwargs)
+    return [record for _, record in iter_jsonl(path)]
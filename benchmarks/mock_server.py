@@ -0,0 +1,283 @@
+"""
+Local stand-in for the TogetherAI and Ollama completion APIs.
+
+Serves the two endpoints litellm talks to, OpenAI-style
+/v1/chat/completions (TogetherAI, with TOGETHER_AI_API_BASE pointing here)
+and Ollama's /api/generate, /api/chat and /api/show, from a thread per
+connection. Each response sleeps for `latency` seconds plus
+`per_token_latency` per completion token, and requests beyond
+`requests_per_minute` get a 429, so rate-limit handling can be exercised
+offline. The text returned for a prompt comes from `responder(prompt, seed)`.
+Non-streaming responses stop at max_tokens (num_predict for Ollama) with
+finish_reason "length". Prefill costs `per_prompt_token_latency` per prompt token. With `kv_slots`,
+each model keeps that many recent prompts, like Ollama's per-slot KV cache:
+the prefix a request shares with the closest one is not prefilled again, and
+is reported the way each API does (a lower prompt_eval_count for Ollama,
+usage.prompt_tokens_details.cached_tokens for the OpenAI-style endpoint).
+Streaming requests get the text in ~4-character tokens, each after
+`per_token_latency`; a client that disconnects early stops generation, and
+the tokens it saved are counted in `tokens_cancelled`.
+
+Run standalone to point eval_small_models.py or the hint scripts at it:
+
+    python -m benchmarks.mock_server --port 11434 --latency 0.5 --rpm 120
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_responder(prompt, seed):
+    digest = hashlib.sha256(f"{prompt}|{seed}".encode("utf-8")).digest()
+    return f"Working through the hints step by step.\n<answer>{digest[0] % 10}</answer>"
+
+
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _split_tokens(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class MockServer:
+    def __init__(self, responder=default_responder, latency=0.05, per_token_latency=0.0,
+                 requests_per_minute=None, per_prompt_token_latency=0.0, kv_slots=0, host="127.0.0.1", port=0):
+        self.responder = responder
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.requests_per_minute = requests_per_minute
+        self.per_prompt_token_latency = per_prompt_token_latency
+        self.kv_slots = kv_slots
+        self.requests = 0
+        self.rate_limited = 0
+        self.tokens_streamed = 0
+        self.tokens_cancelled = 0
+        self.prompt_tokens_evaluated = 0
+        self.prompt_tokens_cached = 0
+        self._recent = collections.deque()
+        self._slots = collections.defaultdict(list)  # model -> recent prompts, oldest first
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _admit(self):
+        """Sliding one-minute window; False means the request gets a 429."""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.requests_per_minute is None:
+                return True
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_minute:
+                self.rate_limited += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def _prefill(self, model, prompt):
+        """Sleeps for the prompt tokens not in a KV slot; returns (prompt_tokens, cached_tokens)."""
+        total, cached = _count_tokens(prompt), 0
+        with self._lock:
+            if self.kv_slots:
+                slots = self._slots[model]
+                shared = [len(os.path.commonprefix([previous, prompt])) for previous in slots]
+                best = max(range(len(slots)), key=shared.__getitem__, default=None)
+                if best is not None and shared[best]:
+                    cached = min(total - 1, shared[best] // 4)  # the last prompt token is always evaluated
+                    slots.pop(best)
+                elif len(slots) >= self.kv_slots:
+                    slots.pop(0)
+                slots.append(prompt)
+            self.prompt_tokens_evaluated += total - cached
+            self.prompt_tokens_cached += cached
+        time.sleep(self.per_prompt_token_latency * (total - cached))
+        return total, cached
+
+    def _generate(self, model, prompt, seed, max_tokens=None):
+        """(text, prompt_tokens, cached_tokens, completion_tokens, finish_reason); text past max_tokens is cut off."""
+        text = self.responder(prompt, seed)
+        finish_reason = "stop"
+        if max_tokens and _count_tokens(text) > max_tokens:
+            text, finish_reason = "".join(_split_tokens(text)[:max_tokens]), "length"
+        prompt_tokens, cached_tokens = self._prefill(model, prompt)
+        completion_tokens = _count_tokens(text)
+        time.sleep(self.latency + self.per_token_latency * completion_tokens)
+        return text, prompt_tokens, cached_tokens, completion_tokens, finish_reason
+
+    def _stream(self, model, prompt, seed, write_token):
+        """Sends tokens one at a time; returns (prompt_tokens, cached_tokens, tokens sent) or None if the client went away."""
+        text = self.responder(prompt, seed)
+        tokens = _split_tokens(text)
+        prompt_tokens, cached_tokens = self._prefill(model, prompt)
+        time.sleep(self.latency)
+        for i, token in enumerate(tokens):
+            time.sleep(self.per_token_latency)
+            try:
+                write_token(token)
+            except (BrokenPipeError, ConnectionResetError):
+                with self._lock:
+                    self.tokens_streamed += i
+                    self.tokens_cancelled += len(tokens) - i
+                return None
+        with self._lock:
+            self.tokens_streamed += len(tokens)
+        return prompt_tokens, cached_tokens, len(tokens)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _start_stream(self, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _end_stream(self, data=b""):
+                if data:
+                    self._write_chunk(data)
+                self.wfile.write(b"0\r\n\r\n")
+                self.close_connection = True
+
+            def _stream_openai(self, request, prompt):
+                self._start_stream("text/event-stream")
+                created = int(time.time())
+
+                def event(delta, finish_reason=None, usage=None):
+                    payload = {"id": "mock", "object": "chat.completion.chunk", "created": created, "model": request.get("model"),
+                               "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    if usage:
+                        payload["usage"] = usage
+                    return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+                counts = server._stream(request.get("model"), prompt, request.get("seed"),
+                                        lambda token: self._write_chunk(event({"content": token})))
+                if counts is not None:
+                    self._end_stream(event({}, "stop", self._openai_usage(*counts)) + b"data: [DONE]\n\n")
+
+            def _openai_usage(self, prompt_tokens, cached_tokens, completion_tokens):
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+                if server.kv_slots:
+                    usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+                return usage
+
+            def _stream_ollama(self, request, prompt, seed, chat):
+                self._start_stream("application/x-ndjson")
+                model = request.get("model")
+
+                def line(token, **extra):
+                    payload = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), **extra}
+                    if chat:
+                        payload["message"] = {"role": "assistant", "content": token}
+                    else:
+                        payload["response"] = token
+                    return (json.dumps(payload) + "\n").encode("utf-8")
+
+                counts = server._stream(model, prompt, seed, lambda token: self._write_chunk(line(token, done=False)))
+                if counts is not None:
+                    # Like Ollama, prompt_eval_count only counts the prompt tokens that were evaluated.
+                    self._end_stream(line("", done=True, done_reason="stop", prompt_eval_count=counts[0] - counts[1], eval_count=counts[2]))
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/api/show":
+                    return self._send(200, {"model_info": {}, "details": {}, "template": ""})
+                if not server._admit():
+                    return self._send(429, {"error": {"message": "rate limit exceeded", "type": "rate_limit"}})
+                if self.path.endswith("/chat/completions"):
+                    prompt = request["messages"][-1]["content"]
+                    if request.get("stream"):
+                        return self._stream_openai(request, prompt)
+                    text, prompt_tokens, cached_tokens, completion_tokens, finish_reason = server._generate(
+                        request.get("model"), prompt, request.get("seed"), request.get("max_tokens"))
+                    return self._send(200, {
+                        "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": request.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                        "usage": self._openai_usage(prompt_tokens, cached_tokens, completion_tokens),
+                    })
+                if self.path in ("/api/generate", "/api/chat"):
+                    if self.path == "/api/chat":
+                        prompt = request["messages"][-1]["content"]
+                    else:
+                        # litellm wraps the message as "### User:\n...\n\n".
+                        prompt = request.get("prompt", "").removeprefix("### User:\n").removesuffix("\n\n")
+                    options = request.get("options") or {}
+                    seed = options.get("seed")
+                    if request.get("stream"):
+                        return self._stream_ollama(request, prompt, seed, chat=self.path == "/api/chat")
+                    text, prompt_tokens, cached_tokens, completion_tokens, finish_reason = server._generate(
+                        request.get("model"), prompt, seed, options.get("num_predict"))
+                    return self._send(200, {
+                        "model": request.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                        "response": text, "message": {"role": "assistant", "content": text}, "done": True,
+                        "done_reason": finish_reason, "prompt_eval_count": prompt_tokens - cached_tokens, "eval_count": completion_tokens,
+                    })
+                self._send(404, {"error": f"unknown endpoint {self.path}"})
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per request")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute before answering 429")
+    parser.add_argument("--per-prompt-token-latency", type=float, default=0.0, help="Seconds of prefill per uncached prompt token")
+    parser.add_argument("--kv-slots", type=int, default=0, help="Recent prompts kept per model for prefix reuse (0: no KV cache)")
+    args = parser.parse_args()
+    server = MockServer(latency=args.latency, per_token_latency=args.per_token_latency,
+                        requests_per_minute=args.rpm, per_prompt_token_latency=args.per_prompt_token_latency,
+                        kv_slots=args.kv_slots, port=args.port)
+    print(f"mock completion server on {server.url}")
+    server.start()._thread.join()
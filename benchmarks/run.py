@@ -0,0 +1,436 @@
+"""
+Benchmarks for the generation, extraction and grading hot paths.
+
+Everything runs offline: generation goes to benchmarks/mock_server.py and
+answers come from the corpus in benchmarks/corpus.py. Each benchmark runs in
+its own subprocess, so peak memory (max RSS of the process and of its
+grading workers) is measured per benchmark and latex2sympy's global state
+does not leak between them. The startup benchmark times each entry point in
+a fresh interpreter against STARTUP_BUDGET_SECONDS.
+
+    python -m benchmarks.run                      # all benchmarks
+    python -m benchmarks.run extraction grading   # a subset
+    python -m benchmarks.run --compare .cache/benchmarks/<earlier>.json
+
+Results are written to .cache/benchmarks/<timestamp>-<commit>.json so runs
+on different commits can be compared.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from benchmarks.corpus import DEFAULT_DATASET, load_corpus
+from elis.metrics import percentile
+
+DEFAULT_OUT_DIR = os.path.join(REPO_ROOT, ".cache", "benchmarks")
+PROBLEMS_DATASET = os.path.join(REPO_ROOT, "data", "omnimath_100.jsonl")
+# Fresh-interpreter start-up allowed for each entry point (import, or --help).
+# litellm alone takes seconds to import, so this fails if it (or sympy,
+# numpy, datasets) is imported at module level again.
+STARTUP_BUDGET_SECONDS = 0.5
+STARTUP_IMPORTS = ("elis.eval_small_models", "elis.sweep", "data.make_hint_data", "data.make_tailored_hints", "data.make_new_data")
+STARTUP_SCRIPTS = ("elis.eval_small_models", "elis.sweep")
+HEAVY_MODULES = ("litellm", "sympy", "latex2sympy2", "numpy", "datasets", "matplotlib")
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.removeprefix("bench_")] = fn
+    return fn
+
+
+_LEGACY_ANSWER_RE = re.compile(r"<answer>(.*?)</answer>|\\boxed{(.*?)}", re.DOTALL)
+
+
+def legacy_fish_answer(response):
+    """The regex extractor fish_answer used before elis.extraction, kept as the baseline."""
+    for match in _LEGACY_ANSWER_RE.finditer(response):
+        return (match.group(1) if match.group(1) is not None else match.group(2)).strip()
+    return None
+
+
+@benchmark
+def bench_extraction(args):
+    """extract_answer over every corpus output, against the legacy regex."""
+    from elis.extraction import LAST, extract_answers
+
+    outputs = [record["output"] for record in load_corpus(args.corpus)] * args.repeat
+    start = time.perf_counter()
+    answers = extract_answers(outputs)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extract_answers(outputs, LAST)
+    last_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = [legacy_fish_answer(output) for output in outputs]
+    regex_seconds = time.perf_counter() - start
+    return {"items": len(outputs), "extracted": sum(a is not None for a in answers),
+            "differs_from_regex": sum(a != b for a, b in zip(answers, legacy)),
+            "last_policy_rate": len(outputs) / last_seconds, "regex_rate": len(outputs) / regex_seconds,
+            "speedup_vs_regex": regex_seconds / elapsed,
+            "seconds": elapsed, "rate": len(outputs) / elapsed, "unit": "outputs/s"}
+
+
+@benchmark
+def bench_grading(args):
+    """Extracted corpus answers through a fresh GradingPool (worker start-up excluded)."""
+    from elis.eval_small_models import fish_answer
+    from elis.grading import TIMEOUT, GradingPool
+
+    pairs = [(fish_answer(record["output"]), record["truth"]) for record in load_corpus(args.corpus)]
+    with GradingPool(workers=args.grade_workers) as pool:
+        start = time.perf_counter()
+        statuses = [future.result() for future in [pool.submit(ans, truth) for ans, truth in pairs]]
+        elapsed = time.perf_counter() - start
+        tiers = dict(pool.tier_counts)
+    return {"items": len(pairs), "timeouts": statuses.count(TIMEOUT), "tiers": tiers,
+            "seconds": elapsed, "rate": len(pairs) / elapsed, "unit": "answers/s"}
+
+
+@benchmark
+def bench_load_data(args):
+    """Columnar conversion and full column scans of the hint dataset, replicated --scale times."""
+    from elis.dataset import open_dataset
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "scaled.jsonl")
+        with open(DEFAULT_DATASET, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        with open(source, "w", encoding="utf-8") as f:
+            for _ in range(args.scale):
+                f.writelines(lines)
+        store = os.path.join(tmp, "store")
+
+        start = time.perf_counter()
+        data = open_dataset(source, store_dir=store)
+        convert_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data = open_dataset(source, store_dir=store)
+        chars = sum(len(value) for name in ("question", "hint") for value in data[name])
+        scan_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        window = data.rows(len(data) // 2, len(data) // 2 + 100)
+        list(window["question"])
+        slice_seconds = time.perf_counter() - start
+    return {"rows": len(data), "chars": chars, "convert_seconds": convert_seconds, "scan_seconds": scan_seconds,
+            "slice_100_seconds": slice_seconds, "seconds": convert_seconds + scan_seconds,
+            "rate": len(data) / scan_seconds, "unit": "rows/s scanned"}
+
+
+@benchmark
+def bench_eval(args):
+    """End-to-end evaluate() against the mock Ollama server: generation, extraction and grading."""
+    from benchmarks.mock_server import MockServer
+    from elis import eval_small_models as E
+
+    corpus = load_corpus(args.corpus)
+    outputs = {}
+    for record in corpus:
+        outputs.setdefault(record["question"], []).append(record["output"])
+    data = E.load_data(DEFAULT_DATASET)
+    get_prompt = functools.partial(E.get_prompt, layout=args.prompt_layout)
+    by_prompt = {get_prompt(q, h): outputs.get(q, [""]) for q, h in zip(data["question"], data["hint"])}
+    data["answer"] = data["final_answer_gt"]
+    data["prompt"] = E.MappedColumn(get_prompt, data["question"], data["hint"])
+
+    def responder(prompt, seed):
+        candidates = by_prompt.get(prompt, [""])
+        return candidates[(seed or 0) % len(candidates)]
+
+    with MockServer(responder, latency=args.latency, per_token_latency=args.per_token_latency,
+                    requests_per_minute=args.mock_rpm, per_prompt_token_latency=args.prefill_latency,
+                    kv_slots=args.kv_slots) as server:
+        E.OLLAMA_API_BASE = server.url
+        E.configure_http_pool(args.max_in_flight)
+        E.get_grading_pool(workers=args.grade_workers)
+        start = time.perf_counter()
+        counts = E.evaluate("ollama/llama3.2:1b", data, n_samples=args.n_samples, max_in_flight=args.max_in_flight,
+                            stream=args.stream, stop_at_answer=not args.no_stream_cutoff)
+        elapsed = time.perf_counter() - start
+    ttfts = E.get_metrics().timings("completion", "ollama/llama3.2:1b", "ttft")
+    return {"problems": len(data), "samples": int(counts[:, 0].sum()), "correct": int(counts[:, 1].sum()),
+            "server_requests": server.requests, "tokens_streamed": server.tokens_streamed,
+            "tokens_cancelled": server.tokens_cancelled, "prompt_tokens_evaluated": server.prompt_tokens_evaluated,
+            "prompt_tokens_cached": server.prompt_tokens_cached, "ttft_p50": percentile(ttfts, 50) if ttfts else None,
+            "seconds": elapsed, "rate": len(data) / elapsed, "unit": "problems/s"}
+
+
+def _startup_seconds(command):
+    """Best-of-3 wall time of a command in a fresh interpreter, and the heavy modules an import pulled in."""
+    best, heavy = None, []
+    for _ in range(3):
+        start = time.perf_counter()
+        proc = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if proc.stdout.startswith("heavy:"):
+            heavy = proc.stdout.split(":", 1)[1].split()
+    return best, heavy
+
+
+@benchmark
+def bench_startup(args):
+    """Start-up of each entry point in a fresh interpreter, against STARTUP_BUDGET_SECONDS; and grading pool warm-up."""
+    from elis.grading import GradingPool
+
+    baseline, _ = _startup_seconds([sys.executable, "-c", "pass"])
+    startup, heavy = {}, {}
+    for module in STARTUP_IMPORTS:
+        probe = f"import sys, {module}; print('heavy:', *[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+        seconds, loaded = _startup_seconds([sys.executable, "-c", probe])
+        startup[f"import {module}"] = seconds - baseline
+        if loaded:
+            heavy[module] = loaded
+    for script in STARTUP_SCRIPTS:
+        seconds, _ = _startup_seconds([sys.executable, "-m", script, "--help"])
+        startup[f"-m {script} --help"] = seconds - baseline
+    over_budget = sorted(name for name, seconds in startup.items() if seconds > STARTUP_BUDGET_SECONDS)
+
+    # Workers only take tasks once they are warm, so grading one cheap
+    # answer per worker measures how long the pool takes to come up.
+    start = time.perf_counter()
+    with GradingPool(workers=args.grade_workers) as pool:
+        pool.grade([str(i) for i in range(pool.workers)], "0")
+        pool_ready = time.perf_counter() - start
+    total = sum(startup.values())
+    return {"startup_seconds": startup, "interpreter_seconds": baseline, "heavy_imports": heavy,
+            "budget_seconds": STARTUP_BUDGET_SECONDS, "over_budget": over_budget,
+            "grading_pool_ready_seconds": pool_ready,
+            "seconds": total, "rate": len(startup) / total, "unit": "startups/s"}
+
+
+_WORD_TARGET_RE = re.compile(r"at most about (\d+) words")
+
+
+def hint_responder(problems):
+    """
+    Hint-like text for the hints benchmark: longer for harder problems
+    (~150 + 60 * difficulty tokens), shorter when the prompt asks for a word
+    count (which it overshoots by up to 45%), and a short tail for a
+    continuation request.
+    """
+    from elis.hint_budget import CONTINUE_PROMPT, WORDS_PER_TOKEN
+
+    def respond(prompt, seed):
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        if prompt == CONTINUE_PROMPT:
+            return "and " * (20 + digest[0] % 40)
+        difficulty = next((item.get("difficulty") or 5 for item in problems if item["problem"] in prompt), 5)
+        tokens = 150 + 60 * difficulty
+        target = _WORD_TARGET_RE.search(prompt)
+        if target:
+            tokens = min(tokens, int(target.group(1)) / WORDS_PER_TOKEN * (0.7 + 0.75 * digest[1] / 255))
+        return "go, " * int(tokens)  # one mock token per word
+    return respond
+
+
+@benchmark
+def bench_hints(args):
+    """Hint generation through CompletionPool against the mock TogetherAI endpoint, with per-problem budgets."""
+    from benchmarks.mock_server import MockServer
+    from data import make_hint_data as H
+    from elis.hint_budget import get_hint_budget
+    from elis.llm_pool import CompletionPool
+    from elis.metrics import get_metrics
+    from elis.pipeline import iter_problems, ordered_map
+
+    items = [item for _, item in iter_problems(PROBLEMS_DATASET) if item.get("problem")]
+    get_hint_budget(fixed=args.hint_budget)
+    with MockServer(hint_responder(items), latency=args.latency, per_token_latency=args.per_token_latency,
+                    requests_per_minute=args.mock_rpm) as server:
+        os.environ["TOGETHER_AI_API_BASE"] = f"{server.url}/v1"
+        pool = CompletionPool(max_concurrency=H.MAX_CONCURRENCY, requests_per_minute=H.REQUESTS_PER_MINUTE,
+                              tokens_per_minute=H.TOKENS_PER_MINUTE, max_retries=H.MAX_RETRIES, retry_delay=args.retry_delay)
+
+        async def run():
+            generated = 0
+            async for _, hint in ordered_map(lambda item: H.generate_hint_for_problem(item["problem"], pool, item), items,
+                                             window=4 * H.MAX_CONCURRENCY):
+                generated += hint is not None
+            return generated
+
+        start = time.perf_counter()
+        generated = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+    spent = get_metrics().totals("hint", H.HINT_PROFILE)
+    return {"problems": len(items), "generated": generated, "server_requests": server.requests,
+            "rate_limited": server.rate_limited, "prompt_tokens": int(spent.get("prompt_tokens", 0)),
+            "completion_tokens": int(spent.get("completion_tokens", 0)), "truncated": int(spent.get("truncated", 0)),
+            "continuations": int(spent.get("continuations", 0)),
+            "seconds": elapsed, "rate": len(items) / elapsed, "unit": "problems/s"}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _descendants_rss_mb(root):
+    """Current RSS of every live descendant of root (Linux /proc only; 0 elsewhere)."""
+    children = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total_kb, stack = 0, list(children.get(root, []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+def run_child(name, args):
+    # Grading workers are forked from the forkserver, not waited for by this
+    # process, so RUSAGE_CHILDREN misses them; sample their RSS instead.
+    peak = {"children": 0.0}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.2):
+            peak["children"] = max(peak["children"], _descendants_rss_mb(os.getpid()))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = BENCHMARKS[name](args)
+    finally:
+        done.set()
+        sampler.join()
+    result["peak_rss_mb"] = _peak_rss_mb()
+    result["children_peak_rss_mb"] = peak["children"]
+    sys.stdout.write("\n" + json.dumps(result) + "\n")
+
+
+def run_benchmark(name, argv, tmp):
+    env = dict(
+        os.environ,
+        ELIS_CACHE_PATH=os.path.join(tmp, "completions.sqlite"),
+        ELIS_CACHE_BYPASS="1",
+        ELIS_RESULTS_PATH=os.path.join(tmp, "eval_results.sqlite"),
+        ELIS_RESULTS_BYPASS="1",
+        ELIS_DATASET_DIR=os.path.join(tmp, "datasets"),
+        ELIS_HINT_SCALES_PATH=os.path.join(tmp, "hint_scales.json"),
+        LITELLM_LOCAL_MODEL_COST_MAP="True",
+    )
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", name, *argv],
+                          cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr[-4000:], file=sys.stderr)
+        return {"error": f"exit code {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    def git(*cmd):
+        return subprocess.run(["git", *cmd], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<12} {'rate':>12} {'unit':<16} {'seconds':>9} {'peak MB':>9} {'workers MB':>11}" + ("   vs baseline" if baseline else ""))
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<12} {r['error']}")
+            continue
+        line = (f"{name:<12} {r['rate']:>12.1f} {r['unit']:<16} {r['seconds']:>9.2f}"
+                f" {r['peak_rss_mb']:>9.1f} {r['children_peak_rss_mb']:>11.1f}")
+        old = (baseline or {}).get(name)
+        if old and "rate" in old:
+            line += f"   {r['rate'] / old['rate']:.2f}x rate, {r['peak_rss_mb'] - old['peak_rss_mb']:+.1f} MB"
+        print(line)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", default=[], help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--corpus", type=str, default=None, help="JSONL of recorded outputs (question, truth, output); default is synthesized")
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the corpus for the extraction benchmark")
+    parser.add_argument("--scale", type=int, default=100, help="Copies of the hint dataset for the load_data benchmark")
+    parser.add_argument("--grade-workers", type=int, default=None, help="Grading processes (default: one per core)")
+    parser.add_argument("--n-samples", type=int, default=4, help="Samples per problem in the eval benchmark")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Concurrent requests in the eval benchmark")
+    parser.add_argument("--stream", action="store_true", help="Stream responses in the eval benchmark")
+    parser.add_argument("--no-stream-cutoff", action="store_true", help="With --stream, read responses to the end")
+    parser.add_argument("--prompt-layout", type=str, choices=("prefix", "legacy"), default="prefix", help="Prompt layout in the eval benchmark")
+    parser.add_argument("--prefill-latency", type=float, default=0.0, help="Mock server seconds per uncached prompt token")
+    parser.add_argument("--kv-slots", type=int, default=4, help="Mock server prompts kept per model for prefix reuse (0: no KV cache)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server seconds per request")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="Mock server extra seconds per completion token")
+    parser.add_argument("--mock-rpm", type=int, default=None, help="Mock server requests per minute before answering 429")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="CompletionPool retry delay in the hints benchmark")
+    parser.add_argument("--hint-budget", type=int, default=None, help="Fixed max_tokens in the hints benchmark (default: per-problem budgets; 500 was the old fixed value)")
+    parser.add_argument("--out-dir", type=str, default=DEFAULT_OUT_DIR, help="Where result files are written")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier result file to compare against")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    raw = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(raw)
+
+    if args.child:
+        run_child(args.child, args)
+        return
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    names = args.benchmarks or list(BENCHMARKS)
+    forwarded = [a for a in raw if a not in names]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            print(f"running {name}...", flush=True)
+            results[name] = run_benchmark(name, forwarded, tmp)
+
+    commit, dirty = git_commit()
+    record = {
+        "commit": commit, "dirty": dirty, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("child", "compare", "out_dir")},
+        "results": results,
+    }
+    os.makedirs(args.out_dir, exist_ok=True)
+    out_path = os.path.join(args.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}{'-dirty' if dirty else ''}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    for name, r in results.items():
+        if r.get("over_budget"):
+            print(f"{name}: over the {r['budget_seconds']}s start-up budget: {', '.join(r['over_budget'])}")
+    print(f"results saved to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
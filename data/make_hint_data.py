@@ -1,7 +1,11 @@
-import litellm
+import asyncio
 import os
-import json
-import time
+
+from elis.completion_cache import get_cache
+from elis.hint_budget import budgeted_completion, get_hint_budget
+from elis.llm_pool import CompletionPool
+from elis.metrics import get_metrics
+from elis.pipeline import CheckpointWriter, iter_problems, load_done_keys, ordered_map, problem_hash
 
 # --- Configuration ---
 TOGETHERAI_API_KEY = ""
@@ -10,11 +14,27 @@ INPUT_DATASET_PATH = "omnimath_100.jsonl" # Your original dataset with problem,
 OUTPUT_DATASET_PATH = "omnimath_100_with_hints_v2.jsonl" # Use a new name for the output
 MAX_RETRIES = 3
 RETRY_DELAY = 10
-
-os.environ["TOGETHERAI_API_KEY"] = TOGETHERAI_API_KEY
-
-def generate_hint_for_problem(problem_text):
-    # ... (this function remains the same) ...
+# Concurrency and provider budget for the async generation pool
+MAX_CONCURRENCY = 16
+REQUESTS_PER_MINUTE = 600
+TOKENS_PER_MINUTE = 180000
+# Output is appended record by record; fsync after this many records
+FSYNC_EVERY = 20
+# Reuse identical earlier completions from the on-disk cache (ELIS_CACHE_BYPASS=1 to refresh)
+USE_COMPLETION_CACHE = True
+# Profile name of these hints for the per-problem token budgets and the metrics report
+HINT_PROFILE = "generic"
+
+# Only override the environment when a key is filled in above, so importing
+# this module (e.g. from elis/sweep.py) keeps the caller's key.
+if TOGETHERAI_API_KEY:
+    os.environ["TOGETHERAI_API_KEY"] = TOGETHERAI_API_KEY
+
+async def generate_hint_for_problem(problem_text, pool, item=None):
+    # max_tokens comes from the problem's difficulty and domain (item is the input record).
+    budget = get_hint_budget().budget(item, HINT_PROFILE)
+    words = get_hint_budget().target_words(budget)
+    length = f" (at most about {words} words)" if words else ""
     hint_prompt = f"""
 Here is a math question. Your task is to provide step-by-step hints that would guide a student towards the solution.
 IMPORTANT:
@@ -27,77 +47,28 @@ IMPORTANT:
 Question:
 {problem_text}
 
-Hints:
+Hints{length}:
 """
-    for attempt in range(MAX_RETRIES):
-        try:
-            print(f"    Attempting API call for hint (attempt {attempt + 1}/{MAX_RETRIES})...")
-            response = litellm.completion(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": hint_prompt}],
-                temperature=0.3,
-                max_tokens=500,
-            )
-            if response.choices and response.choices[0].message and response.choices[0].message.content:
-                return response.choices[0].message.content.strip()
-            else:
-                print(f"    Warning: Received unexpected response structure: {response}")
-                if hasattr(response, 'model_dump_json'):
-                    print(f"    Full response dump: {response.model_dump_json(indent=2)}")
-                return None
-        except litellm.exceptions.RateLimitError as rle:
-            print(f"    Rate limit error (attempt {attempt + 1}/{MAX_RETRIES}): {rle}")
-            if attempt < MAX_RETRIES - 1:
-                current_delay = RETRY_DELAY * (2 ** attempt)
-                print(f"    Retrying in {current_delay} seconds due to rate limit...")
-                time.sleep(current_delay)
-            else:
-                print("    Max retries reached due to rate limit. Skipping hint generation for this problem.")
-                return None
-        except Exception as e:
-            print(f"    Error generating hint (attempt {attempt + 1}/{MAX_RETRIES}): {type(e).__name__} - {e}")
-            if attempt < MAX_RETRIES - 1:
-                print(f"    Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print("    Max retries reached. Skipping hint generation for this problem.")
-                return None
-
-def main():
-    input_data = []
-    print(f"Attempting to load dataset from: {INPUT_DATASET_PATH}")
-    # ... (dataset loading logic remains the same) ...
-    try:
-        if INPUT_DATASET_PATH.endswith(".jsonl"):
-            with open(INPUT_DATASET_PATH, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f):
-                    try:
-                        input_data.append(json.loads(line))
-                    except json.JSONDecodeError as je:
-                        print(f"Error decoding JSON on line {line_num+1} in {INPUT_DATASET_PATH}: {je}")
-        elif INPUT_DATASET_PATH.endswith(".json"):
-            with open(INPUT_DATASET_PATH, 'r', encoding='utf-8') as f:
-                input_data = json.load(f)
-        else:
-            print(f"Error: Unsupported input file format: {INPUT_DATASET_PATH}.")
-            return
-    except FileNotFoundError:
-        print(f"Error: Input file not found at {INPUT_DATASET_PATH}")
-        return
-    except Exception as e:
-        print(f"Error loading dataset: {e}")
-        return
-
-    if not isinstance(input_data, list):
-        print(f"Error: Expected a list of problems from {INPUT_DATASET_PATH}, but got {type(input_data)}")
-        return
-    print(f"Loaded {len(input_data)} problems from {INPUT_DATASET_PATH}")
-
-    processed_data = []
-    failed_to_get_hint_count = 0
-
-    for i, item in enumerate(input_data):
-        print(f"\nProcessing problem {i+1}/{len(input_data)}...")
+    response = await budgeted_completion(
+        pool, budget, HINT_PROFILE,
+        label=" for hint",
+        model=LLM_MODEL,
+        messages=[{"role": "user", "content": hint_prompt}],
+        temperature=0.3,
+    )
+    if response is None:
+        print("    Skipping hint generation for this problem.")
+        return None
+    if response.choices and response.choices[0].message and response.choices[0].message.content:
+        return response.choices[0].message.content.strip()
+    print(f"    Warning: Received unexpected response structure: {response}")
+    if hasattr(response, 'model_dump_json'):
+        print(f"    Full response dump: {response.model_dump_json(indent=2)}")
+    return None
+
+def iter_pending_problems(done_hashes, input_path=INPUT_DATASET_PATH):
+    """Yields (index, item) for valid input problems that are not in the output yet."""
+    for i, item in iter_problems(input_path):
         original_problem_text = item.get("problem")
         # --- MODIFIED SECTION TO GET BOTH SOLUTION TYPES ---
         original_detailed_solution = item.get("solution") # This is the long official solution
@@ -107,46 +78,103 @@ def main():
         if not original_problem_text:
             print(f"  Warning: Skipping item {i+1} due to missing 'problem' field.")
             continue
+        if problem_hash(original_problem_text) in done_hashes:
+            continue
         if original_detailed_solution is None:
              print(f"  Warning: Item {i+1} has a missing or null 'detailed_solution' field.")
         if original_concise_answer is None:
              print(f"  Warning: Item {i+1} has a missing or null 'answer' (concise final answer) field. This will be critical for evaluation.")
+        yield i, item
+
+async def process_dataset(done_hashes, writer, input_path=INPUT_DATASET_PATH):
+    pool = CompletionPool(
+        max_concurrency=MAX_CONCURRENCY,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_retries=MAX_RETRIES,
+        retry_delay=RETRY_DELAY,
+        cache=get_cache() if USE_COMPLETION_CACHE else None,
+    )
+    failed_to_get_hint_count = 0
 
+    async def generate(indexed_item):
+        return await generate_hint_for_problem(indexed_item[1]["problem"], pool, indexed_item[1])
 
+    # ordered_map yields in input order, so the output file lines up with the input.
+    async for (i, item), generated_hint in ordered_map(generate, iter_pending_problems(done_hashes, input_path), window=4 * MAX_CONCURRENCY):
+        print(f"\nProblem {i+1}...")
+        original_problem_text = item.get("problem")
         print(f"  Original Problem (first 100 chars): {original_problem_text[:100].replace(os.linesep, ' ')}...")
 
-        generated_hint = generate_hint_for_problem(original_problem_text)
-
         if generated_hint:
             print(f"  Generated Hint (first 100 chars): {generated_hint[:100].replace(os.linesep, ' ')}...")
             # --- MODIFIED DATAPOINT STRUCTURE ---
             new_datapoint = {
                 "question": original_problem_text,
                 "hint": generated_hint,
-                "detailed_solution": original_detailed_solution, # Store the long one for reference
-                "final_answer_gt": original_concise_answer     # Store the short one for evaluation
+                "detailed_solution": item.get("solution"), # Store the long one for reference
+                "final_answer_gt": item.get("answer")     # Store the short one for evaluation
             }
             # You can still include other original fields if needed:
             # new_datapoint["domain"] = item.get("domain")
             # new_datapoint["difficulty"] = item.get("difficulty")
             # new_datapoint["source"] = item.get("source")
             # --- END OF MODIFIED DATAPOINT STRUCTURE ---
-            processed_data.append(new_datapoint)
+            writer.write(new_datapoint)
         else:
             print(f"  Failed to generate hint for problem {i+1}. This problem will not be included in the output.")
             failed_to_get_hint_count += 1
+    return failed_to_get_hint_count
+
+def generate_hint_file(input_path=INPUT_DATASET_PATH, output_path=OUTPUT_DATASET_PATH):
+    """
+    Generates hints for every problem in input_path that output_path does
+    not have yet. Returns (hints written, problems that failed).
+    """
+    # Problems already in the output (from an earlier, interrupted run) are skipped.
+    done_hashes = load_done_keys(output_path, lambda record: problem_hash(record["question"]) if record.get("question") else None)
+    if done_hashes:
+        print(f"Resuming: {len(done_hashes)} problems already present in {output_path}")
+    with CheckpointWriter(output_path, fsync_every=FSYNC_EVERY) as writer:
+        failed_to_get_hint_count = asyncio.run(process_dataset(done_hashes, writer, input_path))
+    print(f"\nSuccessfully generated hints for {writer.written} problems in this run ({len(done_hashes)} resumed).")
+    return writer.written, failed_to_get_hint_count
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, default=INPUT_DATASET_PATH, help="Omni-MATH style JSONL with problem, solution and answer")
+    parser.add_argument("--output", type=str, default=OUTPUT_DATASET_PATH, help="Hint dataset to write (resumed if it exists)")
+    parser.add_argument("--no-cache", action="store_true", help="Skip completion cache lookups (fresh results still refresh the cache)")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-call metrics as JSONL to this file")
+    parser.add_argument("--fixed-budget", type=int, default=None, help="Give every hint this max_tokens (the old behaviour was 500) instead of per-problem budgets")
+    parser.add_argument("--max-continuations", type=int, default=None, help="Follow-up requests for a hint cut off at its budget (default 1)")
+    args = parser.parse_args(argv)
+    if args.no_cache:
+        get_cache(bypass=True)
+    get_metrics(args.metrics)
+    get_hint_budget(fixed=args.fixed_budget, max_continuations=args.max_continuations)
+
+    print(f"Streaming dataset from: {args.input}")
+    if not os.path.exists(args.input):
+        print(f"Error: Input file not found at {args.input}")
+        return
 
     try:
-        with open(OUTPUT_DATASET_PATH, 'w', encoding='utf-8') as f_out:
-            for entry in processed_data:
-                json.dump(entry, f_out, ensure_ascii=False)
-                f_out.write('\n')
-        print(f"\nSuccessfully generated hints for {len(processed_data)} problems.")
+        _, failed_to_get_hint_count = generate_hint_file(args.input, args.output)
         if failed_to_get_hint_count > 0:
             print(f"Failed to generate hints for {failed_to_get_hint_count} problems.")
-        print(f"New dataset saved to {OUTPUT_DATASET_PATH}")
+        print(f"New dataset saved to {args.output}")
+        if USE_COMPLETION_CACHE:
+            print(get_cache().summary())
+        print(get_hint_budget().summary())
+        get_hint_budget().save()
+        print(get_metrics().report())
+    except ValueError as e:
+        print(f"Error: {e}")
     except IOError as e:
-        print(f"Error writing output file {OUTPUT_DATASET_PATH}: {e}")
+        print(f"Error writing output file {args.output}: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,13 @@
-import litellm
+import asyncio
+import contextlib
 import os
 import json
-import time
+
+from elis.completion_cache import get_cache
+from elis.hint_budget import budgeted_completion, get_hint_budget
+from elis.llm_pool import CompletionPool
+from elis.metrics import get_metrics
+from elis.pipeline import CheckpointWriter, iter_problems, load_done_keys, ordered_map, problem_hash
 
 # --- Configuration ---
 TOGETHERAI_API_KEY = ""
@@ -10,8 +16,19 @@ INPUT_DATASET_PATH = "/Users/ifditahasanorney/Documents/GitHub/eli0.5b/omnimath_
 # OUTPUT_DATASET_PATH will be set dynamically
 MAX_RETRIES = 3
 RETRY_DELAY = 10 # Initial delay in seconds
+# Concurrency and provider budget for the async generation pool
+MAX_CONCURRENCY = 16
+REQUESTS_PER_MINUTE = 600
+TOKENS_PER_MINUTE = 180000
+# Output is appended record by record; fsync after this many records
+FSYNC_EVERY = 20
+# Reuse identical earlier completions from the on-disk cache (ELIS_CACHE_BYPASS=1 to refresh)
+USE_COMPLETION_CACHE = True
 
-os.environ["TOGETHERAI_API_KEY"] = TOGETHERAI_API_KEY
+# Only override the environment when a key is filled in above, so importing
+# this module (e.g. from elis/sweep.py) keeps the caller's key.
+if TOGETHERAI_API_KEY:
+    os.environ["TOGETHERAI_API_KEY"] = TOGETHERAI_API_KEY
 
 # --- Student Model Descriptions ---
 # Define descriptions for the different student models you are targeting
@@ -39,18 +56,29 @@ TARGET_STUDENT_PROFILE_KEY = "Qwen2.5-0.5B" # Change this key to generate hints
 # Example: TARGET_STUDENT_PROFILE_KEY = "Qwen2.5-0.5B"
 # Example: TARGET_STUDENT_PROFILE_KEY = "Generic"
 
+# Run with --all-profiles (or --profiles ...) to fan each problem out to several
+# profiles in one pass over the dataset instead of one run per profile.
+# With --combined, all profiles go to this single file, distinguished by "hint_for_profile".
+COMBINED_OUTPUT_DATASET_PATH = "omnimath_tailored_hints_all_profiles.jsonl"
+
+
+def output_path_for_profile(profile_key):
+    return f"omnimath_tailored_hints_{STUDENT_MODEL_PROFILES[profile_key]['output_suffix']}.jsonl"
+
 SELECTED_STUDENT_MODEL_DESCRIPTION = STUDENT_MODEL_PROFILES[TARGET_STUDENT_PROFILE_KEY]["description"]
 OUTPUT_DATASET_SUFFIX = STUDENT_MODEL_PROFILES[TARGET_STUDENT_PROFILE_KEY]["output_suffix"]
-OUTPUT_DATASET_PATH = f"omnimath_tailored_hints_{OUTPUT_DATASET_SUFFIX}.jsonl"
+OUTPUT_DATASET_PATH = output_path_for_profile(TARGET_STUDENT_PROFILE_KEY)
 
 
-def generate_hint_for_problem(problem_text, student_model_description_for_prompt):
+def hint_prompt_prefix(profile_key):
     """
-    Generates hints for a given math problem, tailored for a student model
-    with the specified properties.
+    The part of the hint prompt that is the same for every problem of a
+    profile: role, student description and instructions. It leads the prompt,
+    so a provider with prompt caching can reuse it instead of prefilling it on
+    every call; only the question after it changes.
     """
-    # The placeholder {student_model_description_for_prompt} will be filled
-    hint_prompt = f"""
+    student_model_description_for_prompt = STUDENT_MODEL_PROFILES[profile_key]["description"]
+    return f"""
 You are an expert math tutor. Your primary task is to provide step-by-step hints that would guide a student AI towards the solution of the given math question.
 
 **The student AI you are generating hints for has the following properties:
@@ -64,90 +92,54 @@ IMPORTANT - Instructions for generating these tailored hints:
 3.  Break down the problem into steps that are appropriately sized for the student AI's capabilities. For less capable AIs, this means very small, atomic steps. For more capable ones, hints can be more consolidated.
 4.  Hints must be progressive, leading the student AI logically and clearly.
 5.  Keep hints concise and use language appropriate for the described student AI. Ensure clarity above all.
+"""
 
+async def generate_hint_for_problem(problem_text, profile_key, pool, item=None):
+    """
+    Generates hints for a given math problem, tailored for the student model
+    described by STUDENT_MODEL_PROFILES[profile_key]. max_tokens comes from
+    the problem's difficulty and domain (item is the input record).
+    """
+    budget = get_hint_budget().budget(item, profile_key)
+    words = get_hint_budget().target_words(budget)
+    if words:
+        # The closing line refers back to the description instead of repeating it after the question.
+        closing = f"Hints (tailored for the student AI described above, at most about {words} words):"
+    else:
+        # A fixed budget keeps the original closing line, so those requests are unchanged.
+        closing = f"Hints (tailored for the student AI with properties: {STUDENT_MODEL_PROFILES[profile_key]['description']}):"
+    # Static prefix first, then the question.
+    hint_prompt = f"""{hint_prompt_prefix(profile_key)}
 Question:
 {problem_text}
 
-Hints (tailored for the student AI with properties: {student_model_description_for_prompt}):
+{closing}
 """
-    for attempt in range(MAX_RETRIES):
-        try:
-            print(f"    Attempting API call for hint (target: {TARGET_STUDENT_PROFILE_KEY}, attempt {attempt + 1}/{MAX_RETRIES})...")
-            response = litellm.completion(
-                model=LLM_MODEL,
-                messages=[{"role": "user", "content": hint_prompt}],
-                temperature=0.3, # Lower temperature for more deterministic and focused hints
-                max_tokens=500,  # Max tokens for the hint generation
-            )
-            if response.choices and response.choices[0].message and response.choices[0].message.content:
-                return response.choices[0].message.content.strip()
-            else:
-                print(f"    Warning: Received unexpected response structure: {response}")
-                if hasattr(response, 'model_dump_json'): # litellm v1.15.10+
-                    print(f"    Full response dump: {response.model_dump_json(indent=2)}")
-                elif isinstance(response, dict): # Older litellm or raw dict
-                     print(f"    Full response dump: {json.dumps(response, indent=2)}")
-                return None
-        except litellm.exceptions.RateLimitError as rle:
-            print(f"    Rate limit error (attempt {attempt + 1}/{MAX_RETRIES}): {rle}")
-            if attempt < MAX_RETRIES - 1:
-                current_delay = RETRY_DELAY * (2 ** attempt) # Exponential backoff
-                print(f"    Retrying in {current_delay} seconds due to rate limit...")
-                time.sleep(current_delay)
-            else:
-                print("    Max retries reached due to rate limit. Skipping hint generation for this problem.")
-                return None
-        except Exception as e:
-            print(f"    Error generating hint (attempt {attempt + 1}/{MAX_RETRIES}): {type(e).__name__} - {e}")
-            if attempt < MAX_RETRIES - 1:
-                print(f"    Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
-            else:
-                print("    Max retries reached. Skipping hint generation for this problem.")
-                return None
-    return None # Should be unreachable if loop completes, but as a fallback
-
-def main():
-    input_data = []
-    print(f"Attempting to load dataset from: {INPUT_DATASET_PATH}")
-    print(f"Hints will be tailored for a student model with profile: '{TARGET_STUDENT_PROFILE_KEY}'")
-    print(f"Output will be saved to: {OUTPUT_DATASET_PATH}")
-
-    try:
-        if INPUT_DATASET_PATH.endswith(".jsonl"):
-            with open(INPUT_DATASET_PATH, 'r', encoding='utf-8') as f:
-                for line_num, line in enumerate(f):
-                    try:
-                        input_data.append(json.loads(line))
-                    except json.JSONDecodeError as je:
-                        print(f"Error decoding JSON on line {line_num+1} in {INPUT_DATASET_PATH}: {je}")
-        elif INPUT_DATASET_PATH.endswith(".json"):
-            with open(INPUT_DATASET_PATH, 'r', encoding='utf-8') as f:
-                input_data = json.load(f)
-        else:
-            print(f"Error: Unsupported input file format: {INPUT_DATASET_PATH}. Must be .jsonl or .json")
-            return
-    except FileNotFoundError:
-        print(f"Error: Input file not found at {INPUT_DATASET_PATH}")
-        return
-    except Exception as e:
-        print(f"Error loading dataset: {e}")
-        return
-
-    if not isinstance(input_data, list):
-        print(f"Error: Expected a list of problems from {INPUT_DATASET_PATH}, but got {type(input_data)}")
-        return
-    if not input_data:
-        print(f"Error: No data loaded from {INPUT_DATASET_PATH}. Please check the file and its content.")
-        return
-        
-    print(f"Loaded {len(input_data)} problems from {INPUT_DATASET_PATH}")
+    response = await budgeted_completion(
+        pool, budget, profile_key,
+        label=f" for hint (target: {profile_key})",
+        model=LLM_MODEL,
+        messages=[{"role": "user", "content": hint_prompt}],
+        temperature=0.3, # Lower temperature for more deterministic and focused hints
+    )
+    if response is None:
+        print("    Skipping hint generation for this problem.")
+        return None
+    if response.choices and response.choices[0].message and response.choices[0].message.content:
+        return response.choices[0].message.content.strip()
+    print(f"    Warning: Received unexpected response structure: {response}")
+    if hasattr(response, 'model_dump_json'): # litellm v1.15.10+
+        print(f"    Full response dump: {response.model_dump_json(indent=2)}")
+    elif isinstance(response, dict): # Older litellm or raw dict
+         print(f"    Full response dump: {json.dumps(response, indent=2)}")
+    return None
 
-    processed_data = []
-    failed_to_get_hint_count = 0
-
-    for i, item in enumerate(input_data):
-        print(f"\nProcessing problem {i+1}/{len(input_data)}...")
+def iter_pending_tasks(profile_keys, done_keys, input_path=INPUT_DATASET_PATH):
+    """
+    Yields (index, item, profile_key) for every valid input problem and every
+    profile that does not have a hint in the output yet. The dataset is read once.
+    """
+    for i, item in iter_problems(input_path):
         original_problem_text = item.get("problem")
         original_detailed_solution = item.get("solution")
         original_concise_answer = item.get("answer")
@@ -155,55 +147,132 @@ def main():
         if not original_problem_text:
             print(f"  Warning: Skipping item {i+1} due to missing 'problem' field.")
             continue
+        key = problem_hash(original_problem_text)
+        pending_profiles = [p for p in profile_keys if (key, p) not in done_keys]
+        if not pending_profiles:
+            continue
         # Warnings for missing solution/answer are fine, but they should still be processed for hints
         if original_detailed_solution is None:
              print(f"  Warning: Item {i+1} has a missing or null 'detailed_solution' (long official solution) field.")
         if original_concise_answer is None:
              print(f"  Warning: Item {i+1} has a missing or null 'answer' (concise final answer) field.")
+        for profile_key in pending_profiles:
+            yield i, item, profile_key
 
+async def process_dataset(profile_keys, done_keys, writers, input_path=INPUT_DATASET_PATH):
+    pool = CompletionPool(
+        max_concurrency=MAX_CONCURRENCY,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_retries=MAX_RETRIES,
+        retry_delay=RETRY_DELAY,
+        cache=get_cache() if USE_COMPLETION_CACHE else None,
+    )
+    failed_to_get_hint_count = {p: 0 for p in profile_keys}
 
-        print(f"  Original Problem (first 100 chars): {str(original_problem_text)[:100].replace(os.linesep, ' ')}...")
+    async def generate(task):
+        # Pass the task's student profile to the hint generation function
+        _, item, profile_key = task
+        return await generate_hint_for_problem(item["problem"], profile_key, pool, item)
 
-        # Pass the selected student model description to the hint generation function
-        generated_hint = generate_hint_for_problem(original_problem_text, SELECTED_STUDENT_MODEL_DESCRIPTION)
+    # ordered_map yields in input order, so each output file lines up with the input.
+    async for (i, item, profile_key), generated_hint in ordered_map(generate, iter_pending_tasks(profile_keys, done_keys, input_path), window=4 * MAX_CONCURRENCY):
+        print(f"\nProblem {i+1} [{profile_key}]...")
+        original_problem_text = item.get("problem")
+        print(f"  Original Problem (first 100 chars): {str(original_problem_text)[:100].replace(os.linesep, ' ')}...")
 
         if generated_hint:
             print(f"  Generated Hint (first 100 chars): {generated_hint[:100].replace(os.linesep, ' ')}...")
             new_datapoint = {
                 "question": original_problem_text,
-                "hint_for_profile": TARGET_STUDENT_PROFILE_KEY, # Record which profile these hints are for
+                "hint_for_profile": profile_key, # Record which profile these hints are for
                 "hint": generated_hint,
-                "detailed_solution": original_detailed_solution,
-                "final_answer_gt": original_concise_answer
+                "detailed_solution": item.get("solution"),
+                "final_answer_gt": item.get("answer")
             }
-            processed_data.append(new_datapoint)
+            writers[profile_key].write(new_datapoint)
         else:
             print(f"  Failed to generate hint for problem {i+1} after {MAX_RETRIES} retries. This problem will not be included in the output.")
-            failed_to_get_hint_count += 1
-            # Optionally, still add the problem but with a null/empty hint
-            # processed_data.append({
-            #     "question": original_problem_text,
-            #     "hint_for_profile": TARGET_STUDENT_PROFILE_KEY,
-            #     "hint": None, # Or "FAILED_TO_GENERATE"
-            #     "detailed_solution": original_detailed_solution,
-            #     "final_answer_gt": original_concise_answer
-            # })
+            failed_to_get_hint_count[profile_key] += 1
+            # Failed problems are not written, so a rerun will retry them.
+    return failed_to_get_hint_count
+
+def record_key(record):
+    if not record.get("question"):
+        return None
+    # Files written before hint_for_profile existed are treated as TARGET_STUDENT_PROFILE_KEY.
+    return problem_hash(record["question"]), record.get("hint_for_profile", TARGET_STUDENT_PROFILE_KEY)
 
+def generate_tailored_hints(profile_keys, output_paths, input_path=INPUT_DATASET_PATH):
+    """
+    Generates hints for every (problem, profile) pair that is not in
+    output_paths[profile] yet. Returns the number of failed problems per profile.
+    """
+    # (problem, profile) pairs already in the outputs (from an earlier, interrupted run) are skipped.
+    done_keys = set()
+    for path in set(output_paths.values()):
+        done_keys |= load_done_keys(path, record_key)
+    if done_keys:
+        print(f"Resuming: {len(done_keys)} (problem, profile) hints already present")
+
+    with contextlib.ExitStack() as stack:
+        writers_by_path = {
+            path: stack.enter_context(CheckpointWriter(path, fsync_every=FSYNC_EVERY))
+            for path in set(output_paths.values())
+        }
+        writers = {p: writers_by_path[path] for p, path in output_paths.items()}
+        failed_to_get_hint_count = asyncio.run(process_dataset(profile_keys, done_keys, writers, input_path))
+    print(f"\nWrote {sum(w.written for w in writers_by_path.values())} hints in this run ({len(done_keys)} resumed).")
+    return failed_to_get_hint_count
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=str, default=INPUT_DATASET_PATH, help="Omni-MATH style JSONL with problem, solution and answer")
+    parser.add_argument("--profiles", type=str, nargs='+', choices=list(STUDENT_MODEL_PROFILES), default=[TARGET_STUDENT_PROFILE_KEY], help="Student profiles to generate hints for")
+    parser.add_argument("--all-profiles", action="store_true", help="Generate hints for every profile in STUDENT_MODEL_PROFILES")
+    parser.add_argument("--combined", action="store_true", help=f"Write all profiles to {COMBINED_OUTPUT_DATASET_PATH} instead of one file per profile")
+    parser.add_argument("--no-cache", action="store_true", help="Skip completion cache lookups (fresh results still refresh the cache)")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-call metrics as JSONL to this file")
+    parser.add_argument("--fixed-budget", type=int, default=None, help="Give every hint this max_tokens (the old behaviour was 500) instead of per-problem budgets")
+    parser.add_argument("--max-continuations", type=int, default=None, help="Follow-up requests for a hint cut off at its budget (default 1)")
+    args = parser.parse_args(argv)
+    get_hint_budget(fixed=args.fixed_budget, max_continuations=args.max_continuations)
+    if args.no_cache:
+        get_cache(bypass=True)
+    get_metrics(args.metrics)
+    profile_keys = list(STUDENT_MODEL_PROFILES) if args.all_profiles else list(dict.fromkeys(args.profiles))
+
+    if args.combined:
+        output_paths = {p: COMBINED_OUTPUT_DATASET_PATH for p in profile_keys}
+    else:
+        output_paths = {p: output_path_for_profile(p) for p in profile_keys}
+
+    print(f"Streaming dataset from: {args.input}")
+    print(f"Hints will be tailored for student model profiles: {', '.join(profile_keys)}")
+    print(f"Output will be saved to: {', '.join(sorted(set(output_paths.values())))}")
+    if not os.path.exists(args.input):
+        print(f"Error: Input file not found at {args.input}")
+        return
 
     try:
-        with open(OUTPUT_DATASET_PATH, 'w', encoding='utf-8') as f_out:
-            for entry in processed_data:
-                json.dump(entry, f_out, ensure_ascii=False)
-                f_out.write('\n')
-        print(f"\nSuccessfully processed {len(input_data)} problems.")
-        print(f"Generated hints for {len(processed_data) - (failed_to_get_hint_count if failed_to_get_hint_count else 0)} problems tailored for '{TARGET_STUDENT_PROFILE_KEY}'.")
-        if failed_to_get_hint_count > 0:
-            print(f"Failed to generate hints for {failed_to_get_hint_count} problems.")
-        print(f"New dataset saved to {OUTPUT_DATASET_PATH}")
+        failed_to_get_hint_count = generate_tailored_hints(profile_keys, output_paths, args.input)
+        for profile_key in profile_keys:
+            print(f"\nGenerated hints tailored for '{profile_key}' -> {output_paths[profile_key]}")
+            if failed_to_get_hint_count[profile_key] > 0:
+                print(f"Failed to generate hints for {failed_to_get_hint_count[profile_key]} problems.")
+        if USE_COMPLETION_CACHE:
+            print(get_cache().summary())
+        print(get_hint_budget().summary())
+        get_hint_budget().save()
+        print(get_metrics().report())
+    except ValueError as e:
+        print(f"Error: {e}")
     except IOError as e:
-        print(f"Error writing output file {OUTPUT_DATASET_PATH}: {e}")
+        print(f"Error writing output file: {e}")
     except Exception as e:
-        print(f"An unexpected error occurred during file writing: {e}")
+        print(f"An unexpected error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
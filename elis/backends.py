@@ -0,0 +1,230 @@
+"""
+Batch backends for the evaluation harness.
+
+By default get_responses sends one HTTP request per prompt through litellm.
+A Backend instead receives the whole set of (prompt, seed) requests for a
+model at once, so an engine with continuous batching can run it at batch
+throughput:
+
+- TransformersBackend runs a Hugging Face model in-process and generates
+  batches of prompts together (CPU or GPU).
+- BatchFileBackend writes the requests as an OpenAI-style batch JSONL file,
+  to be run by a provider batch API or any offline engine, and reads the
+  results file back on the next run.
+
+Completed requests go through the shared completion cache under
+"<backend>/<model>", so re-runs and partially finished batches only
+generate what is missing.
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Optional
+
+from elis.completion_cache import cache_key, get_cache
+
+DEFAULT_TEMPERATURE = 0.8  # Ollama's default, so sampled answers are comparable
+DEFAULT_MAX_TOKENS = 2048
+
+# Hugging Face checkpoints for the Ollama models in eval_small_models.all_models
+HF_MODELS = {
+    "ollama/llama3.2:1b": "meta-llama/Llama-3.2-1B-Instruct",
+    "ollama/llama3.2:3b": "meta-llama/Llama-3.2-3B-Instruct",
+    "ollama/llama3.1:8b": "meta-llama/Llama-3.1-8B-Instruct",
+}
+
+
+class CompletionRequest(NamedTuple):
+    prompt: str
+    seed: Optional[int] = None
+    max_tokens: int = DEFAULT_MAX_TOKENS
+
+
+class BatchPending(Exception):
+    """Raised when a batch job has been written out but its results are not available yet."""
+
+    def __init__(self, path, count):
+        super().__init__(f"{count} requests written to {path}; run the batch and re-run to collect the results")
+        self.path = path
+        self.count = count
+
+
+def _messages(prompt):
+    return [{"content": prompt, "role": "user"}]
+
+
+class Backend(ABC):
+    name = None
+
+    def __init__(self, temperature=DEFAULT_TEMPERATURE):
+        self.temperature = temperature
+
+    def _cache_request(self, model, request):
+        return {
+            "model": f"{self.name}/{model}",
+            "messages": _messages(request.prompt),
+            "temperature": self.temperature,
+            "max_tokens": request.max_tokens,
+            "n": 1,
+            "seed": request.seed,
+        }
+
+    def generate(self, model, requests):
+        """Returns one completion text per request, in order. Cached requests are not regenerated."""
+        import litellm
+
+        cache = get_cache()
+        texts = [None] * len(requests)
+        keyed = [(cache_key(self._cache_request(model, r)), self._cache_request(model, r)) for r in requests]
+        missing = []
+        for i, (key, cache_request) in enumerate(keyed):
+            _, cached = cache.lookup(cache_request)
+            if cached is not None:
+                texts[i] = cached.choices[0].message.content
+            else:
+                missing.append(i)
+        if missing:
+            for i, text in zip(missing, self._generate(model, [requests[i] for i in missing])):
+                texts[i] = text
+                response = litellm.ModelResponse(
+                    model=keyed[i][1]["model"],
+                    choices=[{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                )
+                cache.store(keyed[i][0], keyed[i][1], response)
+        return texts
+
+    @abstractmethod
+    def _generate(self, model, requests):
+        """Completion texts for requests that are not cached, in order."""
+
+
+class TransformersBackend(Backend):
+    """
+    Batched generation with Hugging Face transformers. Requests are grouped by
+    seed (sample index) and generated `batch_size` prompts at a time with left
+    padding, reseeding torch with the group's seed before each batch.
+
+    A sampled batch draws from one random stream, so a request's text also
+    depends on the other prompts in its batch, and those are whichever
+    requests the completion cache did not have. Re-runs are stable because
+    finished requests are cached, not because generation is reproducible.
+    With batch_size=1 each request is generated alone right after
+    torch.manual_seed(seed), so its text depends only on (prompt, seed).
+    """
+
+    name = "transformers"
+
+    def __init__(self, batch_size=16, device=None, temperature=DEFAULT_TEMPERATURE):
+        super().__init__(temperature)
+        self.batch_size = batch_size
+        self.device = device
+        self._loaded = {}
+
+    def _load(self, model):
+        if model not in self._loaded:
+            try:
+                import torch
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+            except ImportError as e:
+                raise ImportError("The transformers backend needs `pip install torch transformers`") from e
+            checkpoint = HF_MODELS.get(model, model)
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            tokenizer = AutoTokenizer.from_pretrained(checkpoint, padding_side="left")
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            lm = AutoModelForCausalLM.from_pretrained(checkpoint, torch_dtype="auto").to(device).eval()
+            self._loaded[model] = (tokenizer, lm, device)
+        return self._loaded[model]
+
+    def _generate(self, model, requests):
+        import torch
+
+        tokenizer, lm, device = self._load(model)
+        texts = [None] * len(requests)
+        by_seed = {}
+        for i, request in enumerate(requests):
+            by_seed.setdefault((request.seed, request.max_tokens), []).append(i)
+        for (seed, max_tokens), indices in by_seed.items():
+            for b in range(0, len(indices), self.batch_size):
+                batch = indices[b:b + self.batch_size]
+                torch.manual_seed(seed or 0)
+                prompts = [
+                    tokenizer.apply_chat_template(_messages(requests[i].prompt), tokenize=False, add_generation_prompt=True)
+                    for i in batch
+                ]
+                inputs = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(device)
+                with torch.inference_mode():
+                    output = lm.generate(
+                        **inputs, max_new_tokens=max_tokens, do_sample=self.temperature > 0,
+                        temperature=self.temperature or None, pad_token_id=tokenizer.pad_token_id,
+                    )
+                completions = tokenizer.batch_decode(output[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+                for i, completion in zip(batch, completions):
+                    texts[i] = completion
+        return texts
+
+
+class BatchFileBackend(Backend):
+    """
+    Two-phase batch-file mode. The first run writes
+    <dir>/<model>.requests.jsonl in the OpenAI batch format (one
+    /v1/chat/completions body per line, keyed by custom_id) and raises
+    BatchPending. Once <dir>/<model>.results.jsonl exists in the matching
+    output format, the next run reads the completions from it.
+    """
+
+    name = "batch-file"
+
+    def __init__(self, directory, temperature=DEFAULT_TEMPERATURE):
+        super().__init__(temperature)
+        self.directory = directory
+
+    def paths(self, model):
+        """(requests file, results file) for a model."""
+        slug = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)
+        return (os.path.join(self.directory, f"{slug}.requests.jsonl"),
+                os.path.join(self.directory, f"{slug}.results.jsonl"))
+
+    def _results(self, path):
+        results = {}
+        if not os.path.exists(path):
+            return results
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                body = (record.get("response") or {}).get("body") or {}
+                choices = body.get("choices") or []
+                if choices and choices[0].get("message", {}).get("content") is not None:
+                    results[record["custom_id"]] = choices[0]["message"]["content"]
+        return results
+
+    def _generate(self, model, requests):
+        bodies = []
+        for request in requests:
+            body = {
+                "model": model.split("/", 1)[-1],
+                "messages": _messages(request.prompt),
+                "temperature": self.temperature,
+                "max_tokens": request.max_tokens,
+                "seed": request.seed,
+            }
+            bodies.append((cache_key(dict(body, model=model)), body))
+
+        path, results_path = self.paths(model)
+        results = self._results(results_path)
+        missing = [(custom_id, body) for custom_id, body in bodies if custom_id not in results]
+        if missing:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for custom_id, body in missing:
+                    f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False) + "\n")
+            raise BatchPending(path, len(missing))
+        return [results[custom_id] for custom_id, _ in bodies]
+
+
+BACKENDS = {
+    TransformersBackend.name: TransformersBackend,
+    BatchFileBackend.name: BatchFileBackend,
+}
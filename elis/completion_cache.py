@@ -0,0 +1,186 @@
+"""
+Content-addressed on-disk cache for LLM completions.
+
+Entries are keyed by a hash of (model, messages, temperature, max_tokens, n,
+seed) and stored in SQLite. When the file grows past `max_bytes`, the least
+recently used entries are evicted. Hint generation (through CompletionPool)
+and get_responses both go through the shared cache, so re-running with an
+unchanged prompt costs nothing.
+
+Set ELIS_CACHE_BYPASS=1 (or pass bypass=True / --no-cache) to skip lookups.
+Fresh results are still written, which refreshes the stored entry.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from elis.metrics import get_metrics
+from elis.paths import cache_dir
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "ELIS_CACHE_PATH",
+    os.path.join(cache_dir(), "completions.sqlite"),
+)
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "n", "seed")
+# Only part of the key when set, so existing entries keep their keys.
+OPTIONAL_KEY_FIELDS = ("stream_cutoff",)
+
+
+def cache_key(request):
+    """Hash of the request fields that determine the completion."""
+    material = {field: request.get(field) for field in KEY_FIELDS}
+    material.update({field: request[field] for field in OPTIONAL_KEY_FIELDS if request.get(field) is not None})
+    blob = json.dumps(material, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _dump_response(response):
+    if hasattr(response, "model_dump"):
+        payload = response.model_dump()
+    elif isinstance(response, dict):
+        payload = response
+    else:
+        payload = dict(response)
+    return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def _has_content(response):
+    try:
+        return bool(response.choices) and all(choice.message.content for choice in response.choices)
+    except AttributeError:
+        return False
+
+
+class CompletionCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, bypass=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, model TEXT, payload TEXT, size INTEGER,"
+            " created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions(last_access)")
+        self._conn.commit()
+        # Running total of stored payload sizes, so put() does not scan the table.
+        self._total = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key):
+        """Returns the stored response payload (a dict) or None."""
+        with self._lock:
+            if self.bypass:
+                self.misses += 1
+                return None
+            row = self._conn.execute("SELECT payload FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, model, response):
+        payload = _dump_response(response)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, payload, size, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, payload, len(payload), now, now),
+            )
+            self._total += len(payload) - (row[0] if row else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        # Other processes may share the file; recount before deleting anything.
+        total = self._stored_bytes()
+        if total <= self.max_bytes:
+            self._total = total
+            return
+        # Trim to 90% of the budget so eviction does not run on every insert.
+        target = int(self.max_bytes * 0.9)
+        for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self._total = total
+
+    def lookup(self, request):
+        """Returns (key, cached ModelResponse or None) for a completion request."""
+        key = cache_key(request)
+        payload = self.get(key)
+        if payload is None:
+            return key, None
+        import litellm
+
+        response = litellm.ModelResponse(**payload)
+        # litellm's own marker for responses served from a cache
+        response._hidden_params["cache_hit"] = True
+        return key, response
+
+    def store(self, key, request, response):
+        # Empty or malformed responses are not cached so that they get retried.
+        if _has_content(response):
+            self.put(key, request.get("model"), response)
+
+    def completion(self, **kwargs):
+        """Drop-in for litellm.completion that goes through the cache."""
+        import litellm
+
+        start = time.perf_counter()
+        key, cached = self.lookup(kwargs)
+        if cached is not None:
+            get_metrics().record_completion(kwargs.get("model"), start, cached, cache_hit=True)
+            return cached
+        response = litellm.completion(**kwargs)
+        get_metrics().record_completion(kwargs.get("model"), start, response, messages=kwargs.get("messages"))
+        self.store(key, kwargs, response)
+        return response
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"completion cache: {self.hits} hits / {self.misses} misses ({rate:.1%} hit rate), {self.evictions} evictions [{self.path}]"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_cache(path=None, bypass=None):
+    """Returns the process-wide cache, creating it on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            if bypass is None:
+                bypass = os.environ.get("ELIS_CACHE_BYPASS", "") not in ("", "0")
+            _shared_cache = CompletionCache(path or DEFAULT_CACHE_PATH, bypass=bypass)
+        elif bypass is not None:
+            _shared_cache.bypass = bypass
+        return _shared_cache
@@ -0,0 +1,263 @@
+"""
+Columnar, memory-mapped datasets.
+
+A problem/hint JSONL file is converted once into a directory with three
+files per column: the UTF-8 bytes of every value back to back, int64 row
+offsets into those bytes, and one int8 type code per row (missing, string,
+or JSON-encoded non-string). Columns are opened with np.memmap, so nothing
+is read until a value is accessed, and a row range can be sliced off without
+touching the other rows. The converted copy lives under datasets/ in
+cache_dir() (elis/paths.py) and is rebuilt when the source file changes.
+
+    data = open_dataset("omnimath_100_with_hints_v2.jsonl")
+    data["question"][3]
+    data.rows(0, 50)["hint"]
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from array import array
+
+from elis.paths import cache_dir
+from elis.pipeline import iter_jsonl
+
+DEFAULT_STORE_DIR = os.environ.get(
+    "ELIS_DATASET_DIR",
+    os.path.join(cache_dir(), "datasets"),
+)
+FORMAT_VERSION = 1
+
+MISSING, STRING, JSON = 0, 1, 2
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def store_path_for(path, store_dir=DEFAULT_STORE_DIR):
+    """Where the columnar copy of a JSONL file is kept."""
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(store_dir, f"{stem}-{digest}")
+
+
+class _ColumnWriter:
+    def __init__(self, directory, file_stem, rows_before):
+        self.data_path = os.path.join(directory, f"{file_stem}.bytes")
+        self.offsets_path = os.path.join(directory, f"{file_stem}.offsets.npy")
+        self.types_path = os.path.join(directory, f"{file_stem}.types.npy")
+        self._f = open(self.data_path, "wb")
+        self._size = 0
+        # A column first seen on a later row is missing for every earlier row.
+        self.offsets = array("q", [0] * (rows_before + 1))
+        self.types = array("b", [MISSING] * rows_before)
+
+    def append(self, value):
+        if value is None:
+            kind, blob = MISSING, b""
+        elif isinstance(value, str):
+            kind, blob = STRING, value.encode("utf-8")
+        else:
+            kind, blob = JSON, json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._f.write(blob)
+        self._size += len(blob)
+        self.offsets.append(self._size)
+        self.types.append(kind)
+
+    def close(self):
+        import numpy as np
+
+        self._f.close()
+        np.save(self.offsets_path, np.frombuffer(self.offsets, dtype=np.int64))
+        np.save(self.types_path, np.frombuffer(self.types, dtype=np.int8))
+
+
+def convert(path, out_dir=None):
+    """
+    Converts a JSONL file into the columnar layout in one streaming pass and
+    returns the output directory. Malformed lines are skipped, as in
+    iter_jsonl. The directory is replaced atomically.
+    """
+    out_dir = out_dir or store_path_for(path)
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    stamp = _source_stamp(path)
+
+    writers = {}
+    n_rows = 0
+    try:
+        for _, record in iter_jsonl(path):
+            if not isinstance(record, dict):
+                print(f"Skipping non-object record {n_rows + 1} in {path}")
+                continue
+            for name in record:
+                if name not in writers:
+                    writers[name] = _ColumnWriter(tmp_dir, f"c{len(writers)}", n_rows)
+            for name, writer in writers.items():
+                writer.append(record.get(name))
+            n_rows += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    meta = dict(stamp, version=FORMAT_VERSION, rows=n_rows,
+                columns={name: f"c{i}" for i, name in enumerate(writers)})
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+
+def _is_current(store, path):
+    try:
+        with open(os.path.join(store, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    stamp = _source_stamp(path)
+    return meta.get("version") == FORMAT_VERSION and all(meta.get(k) == v for k, v in stamp.items())
+
+
+class Column:
+    """Read-only, lazily decoded view of one column over a row range."""
+
+    def __init__(self, directory, file_stem, start, stop):
+        self._directory = directory
+        self._file_stem = file_stem
+        self.start = start
+        self.stop = stop
+        self._data = None
+        self._offsets = None
+        self._types = None
+
+    def _open(self):
+        if self._data is None:
+            import numpy as np
+
+            stem = os.path.join(self._directory, self._file_stem)
+            self._offsets = np.load(f"{stem}.offsets.npy", mmap_mode="r")
+            self._types = np.load(f"{stem}.types.npy", mmap_mode="r")
+            # np.memmap refuses empty files.
+            if os.path.getsize(f"{stem}.bytes"):
+                self._data = np.memmap(f"{stem}.bytes", dtype=np.uint8, mode="r")
+            else:
+                self._data = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _value(self, row):
+        kind = self._types[row]
+        if kind == MISSING:
+            return None
+        text = self._data[self._offsets[row]:self._offsets[row + 1]].tobytes().decode("utf-8")
+        return text if kind == STRING else json.loads(text)
+
+    def __getitem__(self, index):
+        self._open()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return Column(self._directory, self._file_stem, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("column index out of range")
+        return self._value(self.start + index)
+
+    def __iter__(self):
+        self._open()
+        for row in range(self.start, self.stop):
+            yield self._value(row)
+
+
+class MappedColumn:
+    """A column computed row by row from other columns, e.g. prompts from questions and hints."""
+
+    def __init__(self, fn, *columns):
+        self.fn = fn
+        self.columns = columns
+
+    def __len__(self):
+        return min(len(column) for column in self.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MappedColumn(self.fn, *(column[index] for column in self.columns))
+        return self.fn(*(column[index] for column in self.columns))
+
+    def __iter__(self):
+        return map(self.fn, *self.columns)
+
+
+class ColumnarDataset:
+    """
+    Mapping of column name to Column over a row range. Columns are opened on
+    first access. Assigning a column (any sequence of the same length) adds it
+    to this view only; the files on disk are never modified.
+    """
+
+    def __init__(self, directory, start=0, stop=None, extra=None):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        rows = self.meta["rows"]
+        self.start = min(start, rows)
+        self.stop = rows if stop is None else max(self.start, min(stop, rows))
+        self._extra = dict(extra or {})
+        self._columns = {}
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def keys(self):
+        return list(self.meta["columns"]) + [name for name in self._extra if name not in self.meta["columns"]]
+
+    def __contains__(self, name):
+        return name in self._extra or name in self.meta["columns"]
+
+    def __getitem__(self, name):
+        if name in self._extra:
+            return self._extra[name]
+        if name not in self._columns:
+            if name not in self.meta["columns"]:
+                raise KeyError(name)
+            self._columns[name] = Column(self.directory, self.meta["columns"][name], self.start, self.stop)
+        return self._columns[name]
+
+    def __setitem__(self, name, column):
+        self._extra[name] = column
+
+    def rows(self, start, stop=None):
+        """
+        View of rows [start, stop) relative to this view; assigned columns are
+        sliced along. Bounds behave as in a Python slice: negative ones count
+        from the end, and out-of-range ones are clamped.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        extra = {name: column[start:stop] for name, column in self._extra.items()}
+        return ColumnarDataset(self.directory, self.start + start, self.start + stop, extra)
+
+
+_convert_lock = threading.Lock()
+
+
+def open_dataset(path, store_dir=DEFAULT_STORE_DIR):
+    """
+    Opens the columnar copy of a JSONL file, converting it first if there is
+    no copy yet or the source has changed since.
+    """
+    store = store_path_for(path, store_dir)
+    # Threads opening the same file (e.g. concurrent sweep cells) convert it once.
+    with _convert_lock:
+        if not _is_current(store, path):
+            convert(path, store)
+    return ColumnarDataset(store)
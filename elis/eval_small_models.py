@@ -1,98 +1,130 @@
-import json
+import functools
 import os
-import re
-import numpy as np
-from litellm import completion
-from sympy.parsing.latex import parse_latex  # :contentReference[oaicite:0]{index=0}
-from sympy import simplify
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from collections import defaultdict
-from latex2sympy2 import latex2sympy
+from collections import Counter
+
+from elis.backends import BACKENDS, BatchPending, CompletionRequest
+from elis.completion_cache import get_cache
+from elis.dataset import MappedColumn, open_dataset
+from elis.extraction import FIRST, POLICIES, extract_answer
+from elis.grading import CORRECT, TRUTH_PARSE_ERROR, get_grading_pool
+from elis.metrics import get_metrics
+from elis.results_store import get_results_store, is_complete, result_key
+from elis.sampling import draw_samples, mean_pass_at_k
+from elis.streaming import stream_completion
 
 all_models = {
     "1": "ollama/llama3.2:1b",
     "3": "ollama/llama3.2:3b",
     "8": "ollama/llama3.1:8b"
 }
+OLLAMA_API_BASE = "http://localhost:11434"
+# Requests kept in flight per model; match the server's parallel slots (OLLAMA_NUM_PARALLEL).
+DEFAULT_MAX_IN_FLIGHT = 4
+# How long Ollama keeps the model (and the KV cache of each slot) loaded after
+# a request. Its default is 5 minutes, which a slow grading phase or a gap
+# between models can outlast, forcing a reload and a full prefill.
+OLLAMA_KEEP_ALIVE = os.environ.get("ELIS_OLLAMA_KEEP_ALIVE", "30m")
+
+def resolve_model(model):
+    """Accepts either a key of all_models ("1", "3", "8") or a full litellm model name."""
+    return all_models.get(model, model)
+
+# Set by configure_http_pool; passed to litellm as client= on every evaluation call.
+_http_client = None
 
-def get_responses(model, prompt, k=1):
-    responses = completion(
-        model=all_models[model], 
+def configure_http_pool(max_connections):
+    """
+    Builds one keep-alive HTTP client sized for the number of concurrent
+    requests. get_responses hands it to litellm with every call (its Ollama
+    handler ignores litellm.client_session), so evaluation threads reuse
+    connections to the Ollama server instead of opening a new one per prompt.
+    """
+    global _http_client
+    import httpx
+    from litellm.llms.custom_httpx.http_handler import HTTPHandler
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    _http_client = HTTPHandler(client=httpx.Client(limits=limits, timeout=httpx.Timeout(600.0)))
+
+def get_responses(model, prompt, k=1, seed=None, stream=False, stop_at_answer=True, policy=FIRST):
+    # Goes through the on-disk completion cache; identical requests are not re-sent.
+    # Ollama ignores n, so callers that need several samples ask for one per seed.
+    # stream=True reads the response incrementally (one choice) and, with
+    # stop_at_answer, cuts generation off once the answer is complete.
+    model = resolve_model(model)
+    request = dict(
+        model=model, 
         messages=[{"content": prompt,"role": "user"}], 
-        api_base="http://localhost:11434",
+        api_base=OLLAMA_API_BASE,
         n=k,
+        seed=seed,
         max_tokens=2048,
     )
+    if model.startswith("ollama") and OLLAMA_KEEP_ALIVE:
+        # A top-level request field for Ollama; litellm would put a plain kwarg into options.
+        request["extra_body"] = {"keep_alive": OLLAMA_KEEP_ALIVE}
+    if _http_client is not None:
+        request["client"] = _http_client
+    if stream:
+        responses = stream_completion(stop_at_answer=stop_at_answer, policy=policy, **request)
+    else:
+        responses = get_cache().completion(**request)
     return [
         responses.choices[i].message['content'] for i in range(len(responses.choices))
     ]
 
-def fish_answer(response):
-    answers = []
-    # Regex pattern to find content within <answer>...</answer> OR \boxed{...}
-    # The pattern uses two groups, one for each format.
-    # - Group 1: (.*?) captures content inside <answer>...</answer>
-    # - Group 2: (.*?) captures content inside \boxed{...}
-    # re.DOTALL makes '.' match newlines as well, in case the answer spans multiple lines.
-    # The non-greedy '.*?' is used to match the shortest possible string.
-    pattern = r"<answer>(.*?)</answer>|\\boxed{(.*?)}"
-    
-    for match in re.finditer(pattern, response, re.DOTALL):
-        # Check which group was matched
-        if match.group(1) is not None:  # Matched <answer>content</answer>
-            answers.append(match.group(1).strip()) # .strip() to remove leading/trailing whitespace
-            break
-        elif match.group(2) is not None:  # Matched \boxed{content}
-            answers.append(match.group(2).strip()) # .strip()
-            break
-            
-    if len(answers) == 0: return None
-    return answers[-1]
+def fish_answer(response, policy=FIRST):
+    # Single-pass extractor: <answer>...</answer>, \boxed{...} / \fbox{...} with
+    # nested braces; policy picks the first or the last answer in the response.
+    return extract_answer(response, policy)
 
-def check_answer(answers, truth, backend='antlr'):
-    results = []
-    try:
-        ans_sympy = latex2sympy(truth)
-    except:
+def statuses_to_success(statuses):
+    """Maps grading statuses to the old check_answer result (None if the truth does not parse)."""
+    if TRUTH_PARSE_ERROR in statuses:
         return None
-    for ans in answers:
-        if ans is None:
-            results.append(False)
-        else:
-            try:
-                expr1 = latex2sympy(ans)
-                eq = simplify(expr1 - ans_sympy) == 0
-                results.append(bool(eq))
-            except:
-                print("parsing fail, ", ans)
-                results.append(False)
-
-    return np.array(results)
+    import numpy as np
+
+    return np.array([status == CORRECT for status in statuses])
+
+def check_answer(answers, truth, backend='antlr'):
+    # Grading runs in the worker pool so a hanging simplify cannot stall the run;
+    # timeouts and parse failures count as wrong answers.
+    return statuses_to_success(get_grading_pool().grade(answers, truth))
+
+def sample_answer(model, prompt, seed, stream=False, stop_at_answer=True, policy=FIRST):
+    response = get_responses(model, prompt, 1, seed=seed, stream=stream, stop_at_answer=stop_at_answer, policy=policy)[0]
+    with get_metrics().stage("fish_answer", model=model):
+        return fish_answer(response, policy)
 
 def pass_k(model, prompt, truth, k):
-    responses = get_responses(model, prompt, k)
-    answers = list(map(fish_answer, responses))
+    answers = [sample_answer(model, prompt, seed) for seed in range(k)]
     success = check_answer(answers, truth)
     if success is None: return None
     return success.any()
 
-
 def load_data(file_path="omnimath_100.json"):
-    dataset_with_hints = []
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line_num, line in enumerate(f): # Added line_num for better error reporting
-            try:
-                dataset_with_hints.append(json.loads(line))
-            except json.JSONDecodeError as e:
-                print(f"Skipping malformed line {line_num+1}")
-
-    data = defaultdict(list)
-    for l in dataset_with_hints:
-        for k, v in l.items():
-            data[k].append(v)
-    return data
-
-def get_prompt(question, hint):
+    # Columnar, memory-mapped copy of the JSONL file; columns are decoded on access.
+    return open_dataset(file_path)
+
+# The instructions shared by every prompt come first and are byte-identical
+# across calls. Ollama keeps each slot's KV cache and only evaluates the
+# tokens after the longest prefix it shares with the previous prompt, and
+# providers with prompt caching reuse a matching leading block the same way,
+# so only the question and hint are prefilled on each call.
+PROMPT_PREFIX = (
+    "Here is a math question that you should solve. "
+    "Follow the step-by-step instructions given after the question to arrive at the answer. "
+    "Include your answer in <answer></answer> tag.\n\n"
+)
+PREFIX_LAYOUT = "prefix"
+LEGACY_LAYOUT = "legacy"  # question first, as the prompts behind plot.png
+PROMPT_LAYOUTS = (PREFIX_LAYOUT, LEGACY_LAYOUT)
+
+def get_prompt(question, hint, layout=PREFIX_LAYOUT):
+    if layout == PREFIX_LAYOUT:
+        return f"{PROMPT_PREFIX}Question:\n{question}\n\nStep-by-step instructions:\n{hint}\n"
     return f"""
     Here is a math question that you should solve. 
     {question}
@@ -103,14 +135,114 @@ def get_prompt(question, hint):
     Include your answer in <answer></answer> tag. 
     """
 
-def evaluate(model, data, k=1):
-    success = []
-    for prompt, answer in tqdm(zip(data['prompt'], data['answer']), desc=f"Evaluating {model}"):
-        s = pass_k(model, prompt, answer, k)
-        if s is not None:
-            success.append(s)
+def sampling_params(policy, grader):
+    """What a problem's statuses depend on besides model, prompt, truth and seed; part of the results-store key."""
+    return {"max_tokens": 2048, "policy": policy, "grade_timeout": grader.timeout}
 
-    return np.array(success)
+def evaluate(model, data, n_samples=1, batch_size=None, early_stop=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+             stream=False, stop_at_answer=True, policy=FIRST, backend=None, position=0):
+    """
+    Draws `n_samples` samples per prompt, `batch_size` at a time, with at most
+    `max_in_flight` requests in flight. Each answer is queued for grading on
+    the process pool as soon as it arrives, so grading overlaps with
+    generation. Returns an array of (samples drawn, samples correct) per
+    problem, in prompt order; problems whose ground truth cannot be parsed are
+    dropped, as before. With `stream`, responses are streamed and (with
+    `stop_at_answer`) cut off once the answer is complete. `policy` picks
+    the first or last answer in each response. With a batch `backend`, the
+    whole prompt set is generated in one job instead (see evaluate_batch).
+    Problems whose statuses are in the results store are not drawn again;
+    partly stored ones only draw the missing seeds.
+    """
+    if backend is not None:
+        return evaluate_batch(model, data, backend, n_samples=n_samples, policy=policy, position=position)
+    grader = get_grading_pool()
+    store = get_results_store()
+    params = sampling_params(policy, grader)
+    items = list(zip(data['prompt'], data['answer']))
+    keys = [result_key(resolve_model(model), prompt, truth, params) for prompt, truth in items]
+    stored = [store.get(key) for key in keys]
+    with ThreadPoolExecutor(max_workers=max_in_flight) as sample_executor, \
+            ThreadPoolExecutor(max_workers=max_in_flight) as problem_executor:
+        futures = {
+            problem_executor.submit(
+                draw_samples,
+                functools.partial(sample_answer, model, prompt, stream=stream, stop_at_answer=stop_at_answer, policy=policy),
+                grader, truth,
+                n_samples, batch_size or max_in_flight, sample_executor, early_stop, stored[i],
+            ): i
+            for i, (prompt, truth) in enumerate(items)
+        }
+        statuses = [None] * len(futures)
+        for future in tqdm(as_completed(futures), total=len(futures), desc=f"Evaluating {model}", position=position):
+            i = futures[future]
+            statuses[i] = future.result()
+            store.count(stored[i], n_samples, early_stop)
+            if len(statuses[i]) > len(stored[i]):
+                store.put(keys[i], resolve_model(model), items[i][0], statuses[i])
+    store.flush()
+
+    print(f"grading statuses for {model}: {dict(Counter(s for st in statuses for s in st))}")
+    import numpy as np
+
+    counts = [(len(st), st.count(CORRECT)) for st in statuses if TRUTH_PARSE_ERROR not in st]
+    return np.array(counts, dtype=int).reshape(-1, 2)
+
+def evaluate_batch(model, data, backend, n_samples=1, policy=FIRST, position=0):
+    """
+    Like evaluate, but hands every (prompt, seed) request for the model to a
+    batch backend in one call, then grades all answers on the pool. Returns
+    None if the backend's batch job is still pending.
+    """
+    grader = get_grading_pool()
+    store = get_results_store()
+    params = sampling_params(policy, grader)
+    store_model = f"{backend.name}/{resolve_model(model)}"
+    items = list(zip(data['prompt'], data['answer']))
+    keys = [result_key(store_model, prompt, truth, params) for prompt, truth in items]
+    stored = [store.get(key)[:n_samples] for key in keys]
+    # Only the seeds a problem has no stored status for are generated.
+    missing = [(i, seed) for i, (prompt, _) in enumerate(items) if not is_complete(stored[i], n_samples)
+               for seed in range(len(stored[i]), n_samples)]
+    requests = [CompletionRequest(items[i][0], seed) for i, seed in missing]
+    try:
+        texts = backend.generate(resolve_model(model), requests) if requests else []
+    except BatchPending as pending:
+        print(f"{model}: {pending}")
+        return None
+
+    futures = [[] for _ in items]
+    for (i, _), text in zip(missing, texts):
+        futures[i].append(grader.submit(fish_answer(text, policy), items[i][1]))
+    statuses = []
+    for i, problem in enumerate(tqdm(futures, desc=f"Grading {model}", position=position)):
+        statuses.append(stored[i] + [f.result() for f in problem])
+        store.count(stored[i], n_samples)
+        if problem:
+            store.put(keys[i], store_model, items[i][0], statuses[i])
+    store.flush()
+
+    print(f"grading statuses for {model}: {dict(Counter(s for st in statuses for s in st))}")
+    import numpy as np
+
+    counts = [(len(st), st.count(CORRECT)) for st in statuses if TRUTH_PARSE_ERROR not in st]
+    return np.array(counts, dtype=int).reshape(-1, 2)
+
+def evaluate_models(models, data, interleave=False, **kwargs):
+    """
+    Evaluates several models. With interleave=True all models run at the same
+    time, each with its own `max_in_flight` limit, which keeps the server busy
+    when it can hold several models (OLLAMA_MAX_LOADED_MODELS). Otherwise
+    models run one after another.
+    """
+    if not interleave:
+        return {model: evaluate(model, data, **kwargs) for model in models}
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = {
+            model: executor.submit(evaluate, model, data, position=position, **kwargs)
+            for position, model in enumerate(models)
+        }
+        return {model: future.result() for model, future in futures.items()}
 
 
 if __name__ == "__main__":
@@ -119,13 +251,67 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, nargs='+', default=all_models.values(), help="One or more models to evaluate")
     parser.add_argument("--data", type=str, default="omnimath_100_with_hints_v2.jsonl")
+    parser.add_argument("--rows", type=str, default=None, help="Evaluate only rows START:STOP of the dataset (negative bounds count from the end, as in a slice)")
+    parser.add_argument("--n-samples", type=int, default=1, help="Samples drawn per problem")
+    parser.add_argument("--k", type=int, nargs='+', default=[1], help="Report pass@k for each k (each at most --n-samples)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Samples requested in parallel per problem (default: --max-in-flight)")
+    parser.add_argument("--early-stop", action="store_true", help="Stop sampling a problem once it is solved; only pass@n is reported")
+    parser.add_argument("--stream", action="store_true", help="Stream responses and stop generating once the answer is complete")
+    parser.add_argument("--no-stream-cutoff", action="store_true", help="With --stream, read responses to the end instead of stopping at the answer")
+    parser.add_argument("--answer-policy", type=str, choices=POLICIES, default=FIRST, help="Grade the first or the last answer in each response (last disables the stream cut-off)")
+    parser.add_argument("--backend", type=str, choices=list(BACKENDS), default=None, help="Run the whole prompt set as a batch job instead of one HTTP request per prompt")
+    parser.add_argument("--backend-batch-size", type=int, default=16, help="Prompts per forward batch for the transformers backend")
+    parser.add_argument("--batch-dir", type=str, default="batch", help="Directory for the batch-file backend's request and result files")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Concurrent requests per model")
+    parser.add_argument("--interleave", action="store_true", help="Evaluate all models at the same time instead of one after another")
+    parser.add_argument("--grade-workers", type=int, default=None, help="Grading processes (default: one per core)")
+    parser.add_argument("--grade-timeout", type=float, default=None, help="Seconds allowed per answer check before it counts as a timeout")
+    parser.add_argument("--verdict-cache", type=str, default=None, help="SQLite file to persist grading verdicts between runs (e.g. .cache/verdicts.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Skip completion cache lookups (fresh results still refresh the cache)")
+    parser.add_argument("--no-results-store", action="store_true", help="Re-evaluate every problem instead of reusing stored per-problem results (fresh results are still stored)")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-call metrics as JSONL to this file")
+    parser.add_argument("--prompt-layout", type=str, choices=PROMPT_LAYOUTS, default=PREFIX_LAYOUT, help="Shared instructions first (prefix, KV-cache friendly) or the original question-first prompt (legacy)")
+    parser.add_argument("--keep-alive", type=str, default=OLLAMA_KEEP_ALIVE, help="How long Ollama keeps the model loaded between requests (e.g. 30m, -1 for ever, '' for the server default)")
     args = parser.parse_args()
+    OLLAMA_KEEP_ALIVE = args.keep_alive
+    ks = [args.n_samples] if args.early_stop else sorted(set(args.k))
+    if max(ks) > args.n_samples:
+        parser.error("every --k must be at most --n-samples")
+    if args.no_cache:
+        get_cache(bypass=True)
+    if args.no_results_store:
+        get_results_store(bypass=True)
+    get_metrics(args.metrics)
+    get_grading_pool(workers=args.grade_workers, timeout=args.grade_timeout, verdict_cache_path=args.verdict_cache)
 
     data = load_data(args.data)
     data['answer'] = data['final_answer_gt']
-    data['prompt'] = list(map(get_prompt, data['question'], data['hint']))
-    for model in args.model:
-        success = evaluate(model, data)
+    data['prompt'] = MappedColumn(functools.partial(get_prompt, layout=args.prompt_layout), data['question'], data['hint'])
+    if args.rows:
+        start, _, stop = args.rows.partition(":")
+        data = data.rows(int(start or 0), int(stop) if stop else None)
+    backend = None
+    if args.backend == "transformers":
+        backend = BACKENDS[args.backend](batch_size=args.backend_batch_size)
+    elif args.backend == "batch-file":
+        backend = BACKENDS[args.backend](args.batch_dir)
+    if backend is not None and args.early_stop:
+        parser.error("--early-stop needs per-request sampling; it cannot be combined with --backend")
+    models = list(args.model)
+    configure_http_pool(args.max_in_flight * (len(models) if args.interleave else 1))
+    results = evaluate_models(
+        models, data, interleave=args.interleave, n_samples=args.n_samples, batch_size=args.batch_size,
+        early_stop=args.early_stop, max_in_flight=args.max_in_flight,
+        stream=args.stream, stop_at_answer=not args.no_stream_cutoff, policy=args.answer_policy,
+        backend=backend,
+    )
+    for model, counts in results.items():
+        if counts is None:
+            continue
         print(f"\n\n---------Evaluating model {model}--------\n\n\n")
-        print("success rate for pass@1: ", np.mean(success))
-
+        for k in ks:
+            print(f"success rate for pass@{k}: ", mean_pass_at_k(counts, k))
+    print(get_grading_pool().tier_summary())
+    print(get_results_store().summary())
+    print(get_cache().summary())
+    print(get_metrics().report())
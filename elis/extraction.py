@@ -0,0 +1,118 @@
+"""
+Answer extraction from model responses.
+
+The response is scanned left to right for answer openers (<answer>,
+\\boxed{ and \\fbox{), and each opener is matched to its closer: </answer>
+for the tag, the matching brace for boxed answers. Braces are counted with
+nesting and backslash escapes are skipped, so \\boxed{\\frac{1}{2}} yields
+\\frac{1}{2} and not \\frac{1. An answer tag that only wraps a boxed answer
+(<answer>\\boxed{7}</answer>) yields the boxed content. Openers that never
+close are skipped, as the old regex skipped them.
+
+policy="first" returns the leftmost answer, like the old fish_answer.
+policy="last" returns the final one, for models that revise their answer.
+"""
+import re
+
+FIRST = "first"
+LAST = "last"
+POLICIES = (FIRST, LAST)
+
+ANSWER_OPEN = "<answer>"
+ANSWER_CLOSE = "</answer>"
+BOX_COMMANDS = ("\\boxed", "\\fbox")
+_OPENERS = (ANSWER_OPEN,) + BOX_COMMANDS
+_BRACE_OPEN_RE = re.compile(r"\s*\{")
+# Backslash escapes (\{, \}, \\) are consumed whole so they never count as braces.
+_BRACE_RE = re.compile(r"\\.|[{}]", re.DOTALL)
+
+
+def _brace_close(text, start, end):
+    """Index of the brace closing the one opened just before `start`, or -1."""
+    depth = 1
+    for match in _BRACE_RE.finditer(text, start, end):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return match.start()
+    return -1
+
+
+def _unwrap_boxed(answer):
+    for command in BOX_COMMANDS:
+        if answer.startswith(command):
+            brace = _BRACE_OPEN_RE.match(answer, len(command))
+            if brace is not None and _brace_close(answer, brace.end(), len(answer)) == len(answer) - 1:
+                return answer[brace.end():-1].strip()
+    return answer
+
+
+def find_opener(text, pos=0, end=None):
+    """(start, opener) of the leftmost answer opener in text[pos:end], or (-1, None)."""
+    end = len(text) if end is None else end
+    start, opener = -1, None
+    for candidate in _OPENERS:
+        # Only look before the best start so far; str.find is much faster than a regex alternation.
+        i = text.find(candidate, pos, end if start < 0 else start + len(candidate) - 1)
+        if i >= 0:
+            start, opener = i, candidate
+    return start, opener
+
+
+def close_opener(text, start, opener, end=None):
+    """
+    (answer, match_end) for the opener at `start`, or None if it does not
+    close within text[:end]. A box command not followed by a brace never
+    closes.
+    """
+    end = len(text) if end is None else end
+    content = start + len(opener)
+    if opener is ANSWER_OPEN:
+        close = text.find(ANSWER_CLOSE, content, end)
+        if close >= 0:
+            return _unwrap_boxed(text[content:close].strip()), close + len(ANSWER_CLOSE)
+        return None
+    brace = _BRACE_OPEN_RE.match(text, content, end)
+    if brace is not None:
+        close = _brace_close(text, brace.end(), end)
+        if close >= 0:
+            return text[brace.end():close].strip(), close + 1
+    return None
+
+
+def next_answer(text, pos=0, end=None):
+    """(answer, opener_start, match_end) for the leftmost answer in text[pos:end] whose opener closes, or None."""
+    end = len(text) if end is None else end
+    while True:
+        start, opener = find_opener(text, pos, end)
+        if start < 0:
+            return None
+        found = close_opener(text, start, opener, end)
+        if found is not None:
+            return found[0], start, found[1]
+        # Unclosed opener: try the next position, like a regex scan would.
+        pos = start + 1
+
+
+def extract_answer(text, policy=FIRST):
+    """The first or last answer in a response, or None if there is none."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown answer policy: {policy!r}. Must be one of {POLICIES}")
+    if not text:
+        return None
+    found = next_answer(text)
+    if policy == FIRST or found is None:
+        return found and found[0]
+    while True:
+        following = next_answer(text, found[2])
+        if following is None:
+            return found[0]
+        found = following
+
+
+def extract_answers(texts, policy=FIRST):
+    """extract_answer over a batch of responses, in order."""
+    return [extract_answer(text, policy) for text in texts]
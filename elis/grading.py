@@ -0,0 +1,478 @@
+"""
+Answer verification in worker processes with a hard per-item timeout.
+
+sympy's simplify is CPU-bound and can hang for minutes on adversarial model
+output. Grading therefore runs in a pool of long-lived worker processes, one
+task at a time per worker. A worker that exceeds the timeout is killed and
+replaced, and the item is graded TIMEOUT (counted as a failure).
+
+Equivalence is decided by the cheapest tier that can decide it:
+normalized string match, exact rational comparison, numeric evaluation at
+random points (which can only prove a mismatch), and finally symbolic
+simplify. Verdicts are the same as running simplify on every item, each
+answer and truth parsed as if in a fresh process.
+
+Parsed expressions are memoized inside each worker, and (answer, truth)
+verdicts are memoized in the pool, optionally in SQLite across runs. pass@k
+with large k and multi-model sweeps therefore grade each distinct answer once.
+"""
+import atexit
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from fractions import Fraction
+
+from elis.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+CORRECT = "correct"
+INCORRECT = "incorrect"
+NO_ANSWER = "no_answer"
+PARSE_ERROR = "parse_error"
+TIMEOUT = "timeout"
+WORKER_ERROR = "worker_error"
+TRUTH_PARSE_ERROR = "truth_parse_error"
+
+# Tier that decided each verdict, reported by GradingPool.tier_summary()
+TIER_PARSE = "parse"
+TIER_STRING = "string"
+TIER_RATIONAL = "rational"
+TIER_NUMERIC = "numeric"
+TIER_SYMBOLIC = "symbolic"
+TIER_TIMEOUT = "timeout"
+TIER_WORKER_ERROR = "worker_error"
+TIER_MEMO = "memo"
+
+DEFAULT_TIMEOUT = 10.0
+# Tries to start a grading worker before a task is graded WORKER_ERROR, and
+# the delay before the second try (doubled for each further one).
+SPAWN_ATTEMPTS = 3
+SPAWN_BACKOFF = 0.5
+PARSE_CACHE_SIZE = 4096
+VERDICT_CACHE_SIZE = 100000
+# Bump when grading logic changes so persisted verdicts are not reused.
+GRADER_VERSION = "2"
+NUMERIC_POINTS = 3
+NUMERIC_TOLERANCE = 1e-8
+# Failures that say nothing about the input; they are raised rather than
+# memoized or graded, so the worker is replaced and the pair is not remembered.
+TRANSIENT_ERRORS = (MemoryError, TimeoutError)
+
+# Whitespace and LaTeX spacing/sizing commands carry no meaning, except
+# between two digits where they may separate digit groups ("1 000").
+_IGNORABLE_RE = re.compile(r"(?<!\d)(?:\s+|\\[,;:!]|\\left(?![a-zA-Z])|\\right(?![a-zA-Z]))|(?:\s+|\\[,;:!])(?!\d)")
+_FRAC_ALIAS_RE = re.compile(r"\\[dt]frac(?![a-zA-Z])")
+_NUMBER = r"\d+(?:\.\d+)?"
+_RATIONAL_RE = re.compile(
+    rf"^(?P<sign>-?)(?:(?P<num>{_NUMBER})(?:/(?P<den>{_NUMBER}))?|\\frac\{{(?P<fnum>{_NUMBER})\}}\{{(?P<fden>{_NUMBER})\}})$"
+)
+
+
+def normalize_answer(s):
+    """Canonical string form used by the string-match tier."""
+    return _FRAC_ALIAS_RE.sub(r"\\frac", _IGNORABLE_RE.sub("", s.strip()))
+
+
+def _as_rational(normalized):
+    """Exact value of a plain integer, decimal, a/b or \\frac{a}{b}; None otherwise."""
+    match = _RATIONAL_RE.match(normalized)
+    if match is None:
+        return None
+    num = match.group("num") or match.group("fnum")
+    den = match.group("den") or match.group("fden") or "1"
+    if Fraction(den) == 0:
+        return None
+    value = Fraction(num) / Fraction(den)
+    return -value if match.group("sign") else value
+
+
+def _numeric_mismatch(diff, truth_expr):
+    """
+    True if diff is clearly nonzero at some random positive point. Anything
+    inconclusive (non-numeric, undefined, tiny) returns False, leaving the
+    decision to simplify.
+    """
+    symbols = sorted(diff.free_symbols, key=str)
+    rng = random.Random(0)
+    for _ in range(NUMERIC_POINTS if symbols else 1):
+        point = {sym: rng.uniform(0.5, 3.0) for sym in symbols}
+        try:
+            value = complex(diff.evalf(30, subs=point))
+            scale = abs(complex(truth_expr.evalf(30, subs=point)))
+        except (TypeError, ValueError, ZeroDivisionError, OverflowError):
+            continue
+        if value != value or scale != scale or abs(value) == float("inf") or scale == float("inf"):
+            continue
+        if abs(value) > NUMERIC_TOLERANCE * max(1.0, scale):
+            return True
+    return False
+
+
+_UNPARSEABLE = object()
+
+
+_parser_state = None
+
+
+def _reset_parser_state():
+    """
+    Restores latex2sympy2's module globals to their values at first use.
+    Parsing ":=" stores a variable there, and parsing a differential rebinds
+    `var` to a Symbol, after which every later atom fails to parse. Without
+    a reset, verdicts would depend on which answers a worker parsed before.
+    """
+    global _parser_state
+    import latex2sympy2
+
+    if _parser_state is None:
+        _parser_state = (dict(latex2sympy2.var), dict(latex2sympy2.variances))
+    latex2sympy2.var, latex2sympy2.variances = dict(_parser_state[0]), dict(_parser_state[1])
+
+
+def _parse_uncached(latex):
+    """
+    latex2sympy from a fresh parser state; returns _UNPARSEABLE instead of
+    raising a parse error. TRANSIENT_ERRORS propagate, so _parse never
+    memoizes them.
+    """
+    from latex2sympy2 import latex2sympy
+
+    _reset_parser_state()
+    try:
+        return latex2sympy(latex)
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception:
+        return _UNPARSEABLE
+
+
+_parse = functools.lru_cache(maxsize=PARSE_CACHE_SIZE)(_parse_uncached)
+
+
+def _parse_answer(ans, truth):
+    # The old check parsed the answer and the truth separately, so an answer
+    # identical to the truth must not share the truth's memoized object.
+    return _parse_uncached(ans) if ans == truth else _parse(ans)
+
+
+def _difference_is_zero(expr, truth_expr):
+    """
+    True if expr - truth_expr is 0 as soon as it is built. simplify(0) == 0,
+    so this is exactly the old check's verdict; False otherwise. oo - oo,
+    nan and relations (which cannot be subtracted) return False and are left
+    to the full check.
+    """
+    try:
+        return bool((expr - truth_expr) == 0)
+    except Exception:
+        return False
+
+
+def grade_answer_tiered(ans, truth):
+    """Grades one extracted answer against the ground truth; returns (status, tier)."""
+    from sympy import simplify
+
+    truth_expr = _parse(truth)
+    if truth_expr is _UNPARSEABLE:
+        return TRUTH_PARSE_ERROR, TIER_PARSE
+    if ans is None:
+        return NO_ANSWER, TIER_PARSE
+
+    norm_ans, norm_truth = normalize_answer(ans), normalize_answer(truth)
+    if norm_ans == norm_truth:
+        # Equal strings are only a shortcut to the old check, not a verdict of their own.
+        expr = _parse_answer(ans, truth)
+        if expr is not _UNPARSEABLE and _difference_is_zero(expr, truth_expr):
+            return CORRECT, TIER_STRING
+    rational_ans, rational_truth = _as_rational(norm_ans), _as_rational(norm_truth)
+    if rational_ans is not None and rational_truth is not None:
+        return (CORRECT if rational_ans == rational_truth else INCORRECT), TIER_RATIONAL
+
+    try:
+        expr = _parse_answer(ans, truth)
+        if expr is _UNPARSEABLE:
+            raise ValueError(ans)
+        diff = expr - truth_expr
+        if _numeric_mismatch(diff, truth_expr):
+            return INCORRECT, TIER_NUMERIC
+        return (CORRECT if bool(simplify(diff) == 0) else INCORRECT), TIER_SYMBOLIC
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception:
+        logger.debug("could not grade answer %r", ans)
+        return PARSE_ERROR, TIER_PARSE
+
+
+def grade_answer(ans, truth):
+    """Grades one extracted answer against the ground truth, in this process."""
+    return grade_answer_tiered(ans, truth)[0]
+
+
+def _worker_main(conn):
+    # Warm latex2sympy's parser and sympy's caches before reporting ready, so
+    # start-up time is never charged against a task's timeout. "1" vs "1"
+    # would stop at the string tier; this pair goes through parse and simplify.
+    grade_answer("\\frac{x}{2}+1", "\\frac{x+2}{2}")
+    conn.send("ready")
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        conn.send(grade_answer_tiered(*task))
+
+
+def _mp_context():
+    # forkserver avoids forking a parent that already runs HTTP and tqdm threads.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        # Import the heavy modules (and the main script, which workers would
+        # otherwise each re-import) once in the fork server; every worker,
+        # including replacements for killed ones, is forked already warm.
+        ctx.set_forkserver_preload(["__main__", "sympy", "latex2sympy2", __name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def _stop_worker(proc):
+    proc.kill()
+    proc.join()
+
+
+class VerdictMemo:
+    """
+    LRU map from (answer, truth) to (status, tier). With a path, verdicts are
+    also written to SQLite and looked up there on an in-memory miss.
+    """
+
+    def __init__(self, maxsize=VERDICT_CACHE_SIZE, path=None, commit_every=100):
+        self.maxsize = maxsize
+        self.commit_every = commit_every
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, status TEXT, tier TEXT)")
+            self._conn.commit()
+
+    @staticmethod
+    def _disk_key(ans, truth):
+        blob = "\0".join([GRADER_VERSION, truth, "" if ans is None else ans])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, ans, truth):
+        key = (ans, truth)
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is not None:
+                self._entries.move_to_end(key)
+                return verdict
+            if self._conn is None:
+                return None
+            row = self._conn.execute("SELECT status, tier FROM verdicts WHERE key = ?", (self._disk_key(ans, truth),)).fetchone()
+            if row is None:
+                return None
+            verdict = tuple(row)
+            self._remember(key, verdict)
+            return verdict
+
+    def put(self, ans, truth, verdict):
+        with self._lock:
+            self._remember((ans, truth), verdict)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, status, tier) VALUES (?, ?, ?)",
+                    (self._disk_key(ans, truth), *verdict),
+                )
+                self._uncommitted += 1
+                if self._uncommitted >= self.commit_every:
+                    self._conn.commit()
+                    self._uncommitted = 0
+
+    def _remember(self, key, verdict):
+        self._entries[key] = verdict
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+class GradingPool:
+    """
+    Grades (answer, truth) pairs across `workers` processes. submit() returns
+    a concurrent.futures.Future, so callers can keep generating while grading
+    runs. Pairs already graded (or currently being graded) are not resent.
+    """
+
+    def __init__(self, workers=None, timeout=DEFAULT_TIMEOUT, verdict_cache_path=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memo = VerdictMemo(path=verdict_cache_path)
+        self._ctx = _mp_context()
+        self._tasks = queue.Queue()
+        self._inflight = {}
+        self._closed = False
+        self.tier_counts = Counter()
+        self._stats_lock = threading.Lock()
+        self._slots = [threading.Thread(target=self._run_slot, daemon=True) for _ in range(self.workers)]
+        for slot in self._slots:
+            slot.start()
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        proc.start()
+        child_conn.close()
+        try:
+            parent_conn.recv()  # "ready"
+        except BaseException:
+            _stop_worker(proc)
+            parent_conn.close()
+            raise
+        return proc, parent_conn
+
+    def _start_worker(self):
+        """A ready (process, connection), or (None, None) if SPAWN_ATTEMPTS tries all failed."""
+        for attempt in range(SPAWN_ATTEMPTS):
+            if attempt:
+                time.sleep(SPAWN_BACKOFF * 2 ** (attempt - 1))
+            try:
+                return self._spawn()
+            except Exception as e:
+                logger.warning("could not start a grading worker (attempt %d/%d): %r", attempt + 1, SPAWN_ATTEMPTS, e)
+        return None, None
+
+    def _run_slot(self):
+        # One thread per worker process: it feeds tasks one at a time and
+        # replaces the process when a task times out or the worker dies. If
+        # no replacement starts, tasks are graded WORKER_ERROR (and the next
+        # task tries again), so every future taken from the queue is resolved.
+        proc, conn = self._start_worker()
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                break
+            future, ans, truth = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if proc is None:
+                    proc, conn = self._start_worker()
+                start = time.perf_counter()
+                if proc is None:
+                    status, tier = WORKER_ERROR, TIER_WORKER_ERROR
+                else:
+                    try:
+                        conn.send((ans, truth))
+                        if conn.poll(self.timeout):
+                            status, tier = conn.recv()
+                        else:
+                            logger.warning("grading timed out after %ss: %r", self.timeout, ans)
+                            status, tier = TIMEOUT, TIER_TIMEOUT
+                            _stop_worker(proc)
+                            proc, conn = self._start_worker()
+                    except (EOFError, OSError):
+                        status, tier = WORKER_ERROR, TIER_WORKER_ERROR
+                        _stop_worker(proc)
+                        proc, conn = self._start_worker()
+                get_metrics().record("stage", "check_answer", seconds=time.perf_counter() - start, tier=tier, status=status)
+                # Timeouts depend on load, so only real verdicts are remembered.
+                if status not in (TIMEOUT, WORKER_ERROR):
+                    self.memo.put(ans, truth, (status, tier))
+            except Exception as e:
+                with self._stats_lock:
+                    self._inflight.pop((ans, truth), None)
+                future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self.tier_counts[tier] += 1
+                self._inflight.pop((ans, truth), None)
+            future.set_result(status)
+        if proc is None:
+            return
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        proc.join(timeout=1)
+        if proc.is_alive():
+            proc.kill()
+
+    def submit(self, ans, truth):
+        if self._closed:
+            raise RuntimeError("GradingPool is closed")
+        verdict = self.memo.get(ans, truth)
+        with self._stats_lock:
+            if verdict is not None:
+                self.tier_counts[TIER_MEMO] += 1
+                future = Future()
+                future.set_result(verdict[0])
+                return future
+            future = self._inflight.get((ans, truth))
+            if future is not None:
+                self.tier_counts[TIER_MEMO] += 1
+                return future
+            future = self._inflight[(ans, truth)] = Future()
+        self._tasks.put((future, ans, truth))
+        return future
+
+    def grade(self, answers, truth):
+        """Grades a list of answers against one truth; returns their statuses."""
+        futures = [self.submit(ans, truth) for ans in answers]
+        return [future.result() for future in futures]
+
+    def tier_summary(self):
+        with self._stats_lock:
+            total = sum(self.tier_counts.values())
+            parts = [f"{tier} {count} ({count / total:.0%})" for tier, count in self.tier_counts.most_common()]
+        return f"grading tiers: {', '.join(parts) if parts else 'none'}"
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._slots:
+            self._tasks.put(None)
+        for slot in self._slots:
+            slot.join()
+        self.memo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_grading_pool(workers=None, timeout=None, verdict_cache_path=None):
+    """Returns the process-wide grading pool, creating it on first use."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = GradingPool(workers=workers, timeout=timeout or DEFAULT_TIMEOUT, verdict_cache_path=verdict_cache_path)
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -0,0 +1,248 @@
+"""
+Per-problem token budgets for hint generation.
+
+Hint generation used to ask for max_tokens=500 on every problem and
+profile, so hints for easy problems ran long and hints for hard ones were
+cut off. HintBudget instead sizes each request from the problem's
+Omni-MATH `difficulty` and `domain`, and the generators tell the model the
+matching length target in the prompt, so short hints are planned short
+rather than truncated. The budget keeps headroom above that target.
+
+Each hint profile's budgets are multiplied by a scale learned from what
+earlier runs observed. When more than TARGET_TRUNCATION of a profile's
+hints stopped at the budget (finish_reason "length"), its scale grows.
+When none did and hints used well under their budget, it shrinks. The
+scales are loaded from a JSON file at start-up and stay fixed for the
+whole run, so a budget depends only on the problem, its profile and that
+file, not on the order in which problems finish. Re-runs and resumes
+therefore build the same requests, and completion cache entries are
+reused. The scripts save the updated scales when a run completes
+(HintBudget.save()). Budgets are rounded to BUDGET_STEP tokens, so the
+completion cache sees few distinct values.
+
+budgeted_completion() only re-requests hints that were cut off: it asks
+the model to continue where it stopped, at most `max_continuations` times,
+and returns the joined text. Tokens spent are recorded as "hint" metric
+events per profile and appear in get_metrics().report().
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+
+from elis.metrics import get_metrics, usage_tokens
+from elis.paths import cache_dir
+
+DEFAULT_MAX_TOKENS = 500  # the old fixed budget, for problems without a difficulty
+BASE_TOKENS = 208
+TOKENS_PER_DIFFICULTY = 48  # Omni-MATH difficulty runs from 1 to 10
+# Multipliers for domains whose hints need more (or fewer) steps than their difficulty suggests
+DOMAIN_FACTORS = (
+    ("Geometry", 1.15),
+    ("Combinatorics", 1.15),
+    ("Math Word Problems", 0.85),
+    ("Prealgebra", 0.85),
+)
+MIN_TOKENS = 160
+MAX_TOKENS = 1024
+BUDGET_STEP = 32
+# The length asked for in the prompt, as a fraction of the budget, and ~words per token
+TARGET_FRACTION = 0.75
+WORDS_PER_TOKEN = 0.75
+
+DEFAULT_SCALES_PATH = os.environ.get(
+    "ELIS_HINT_SCALES_PATH",
+    os.path.join(cache_dir(), "hint_scales.json"),
+)
+TARGET_TRUNCATION = 0.1
+MIN_OBSERVATIONS = 16  # hints a profile needs in one run before its scale is updated
+GROW = 1.25
+SHRINK = 0.9
+SHRINK_BELOW = 0.5  # median fraction of the budget used
+MIN_SCALE, MAX_SCALE = 0.5, 2.0
+
+CONTINUATION_TOKENS = 256
+DEFAULT_MAX_CONTINUATIONS = 1
+CONTINUE_PROMPT = "You were cut off. Continue the hints exactly where you stopped, without repeating anything."
+
+
+def prior_budget(item):
+    """Budget for a problem from its difficulty and domain, before any adjustment."""
+    difficulty = (item or {}).get("difficulty")
+    if difficulty is None:
+        return DEFAULT_MAX_TOKENS
+    tokens = BASE_TOKENS + TOKENS_PER_DIFFICULTY * float(difficulty)
+    domains = (item or {}).get("domain") or []
+    factors = [factor for name, factor in DOMAIN_FACTORS if any(name in domain for domain in domains)]
+    return tokens * (max(factors) if factors else 1.0)
+
+
+def _finish_reason(response):
+    try:
+        return response.choices[0].finish_reason
+    except (AttributeError, IndexError):
+        return None
+
+
+def _content(response):
+    try:
+        return response.choices[0].message.content or ""
+    except (AttributeError, IndexError):
+        return ""
+
+
+class HintBudget:
+    """
+    Per-problem max_tokens for hint requests. With `fixed`, every request
+    gets that budget and no length target, as before. With a `path`, the
+    per-profile scales are read from it once, here.
+    """
+
+    def __init__(self, fixed=None, max_continuations=DEFAULT_MAX_CONTINUATIONS, continuation_tokens=CONTINUATION_TOKENS,
+                 path=None):
+        self.fixed = fixed
+        self.max_continuations = max_continuations
+        self.continuation_tokens = continuation_tokens
+        self.path = path
+        self._lock = threading.Lock()
+        self._scales = self._load(path)
+        self._observed = defaultdict(list)  # profile -> [(fraction used, truncated)]
+
+    @staticmethod
+    def _load(path):
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return {str(profile): float(scale) for profile, scale in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"Ignoring unreadable hint budget scales {path}: {e}")
+            return {}
+
+    def scale(self, profile):
+        """The profile's budget multiplier for this run."""
+        return self._scales.get(str(profile), 1.0)
+
+    def budget(self, item, profile=None):
+        """max_tokens for a problem (an Omni-MATH record) and hint profile."""
+        if self.fixed is not None:
+            return self.fixed
+        tokens = prior_budget(item) * self.scale(profile)
+        tokens = BUDGET_STEP * round(tokens / BUDGET_STEP)
+        return int(min(MAX_TOKENS, max(MIN_TOKENS, tokens)))
+
+    def target_words(self, budget):
+        """Length to ask for in the prompt, or None with a fixed budget."""
+        if self.fixed is not None:
+            return None
+        return max(10, 10 * round(budget * TARGET_FRACTION * WORDS_PER_TOKEN / 10))
+
+    def observe(self, profile, budget, completion_tokens, truncated):
+        """Records how much of its budget a profile's hint used. Budgets in this run do not change."""
+        if self.fixed is not None:
+            return
+        with self._lock:
+            self._observed[str(profile)].append(((completion_tokens or budget) / budget, truncated))
+
+    def learned_scales(self):
+        """The scales for the next run: this run's, adjusted per profile by what it observed."""
+        with self._lock:
+            scales = dict(self._scales)
+            for profile, observed in self._observed.items():
+                if len(observed) < MIN_OBSERVATIONS:
+                    continue
+                truncation = sum(t for _, t in observed) / len(observed)
+                used = sorted(u for u, _ in observed)[len(observed) // 2]
+                scale = self.scale(profile)
+                if truncation > TARGET_TRUNCATION:
+                    scales[profile] = min(MAX_SCALE, scale * GROW)
+                elif truncation == 0 and used < SHRINK_BELOW:
+                    scales[profile] = max(MIN_SCALE, scale * SHRINK)
+        return scales
+
+    def save(self):
+        """Writes learned_scales() to the path for the next run to load. A no-op with a fixed budget or no path."""
+        if self.fixed is not None or not self.path:
+            return
+        scales = self.learned_scales()
+        if scales == self._scales:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(scales, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def settings(self, profile=None):
+        """What a profile's generated hints depend on, for sweep stage fingerprints."""
+        if self.fixed is not None:
+            return {"fixed": self.fixed, "max_continuations": self.max_continuations}
+        return {"base": BASE_TOKENS, "per_difficulty": TOKENS_PER_DIFFICULTY, "domains": DOMAIN_FACTORS,
+                "bounds": (MIN_TOKENS, MAX_TOKENS), "target_fraction": TARGET_FRACTION, "scale": self.scale(profile),
+                "max_continuations": self.max_continuations, "continuation_tokens": self.continuation_tokens}
+
+    def summary(self):
+        if self.fixed is not None:
+            return f"hint budget: fixed at {self.fixed} tokens, up to {self.max_continuations} continuations"
+        learned = self.learned_scales()
+        changes = ", ".join(f"{profile} x{self.scale(profile):.2f}" + (f" -> x{learned[profile]:.2f}" if learned[profile] != self.scale(profile) else "")
+                            for profile in sorted(learned))
+        return f"hint budget: per-problem, up to {self.max_continuations} continuations; scale {changes or 'x1.00 for every profile'}"
+
+
+async def budgeted_completion(pool, budget, profile, messages, label="", controller=None, **kwargs):
+    """
+    pool.acompletion with max_tokens=budget. If the response stops at the
+    budget, the model is asked to continue (up to the controller's
+    max_continuations) and the text is joined into the returned response.
+    Returns None when pool.acompletion does.
+    """
+    controller = controller or get_hint_budget()
+    response = await pool.acompletion(label=label, messages=messages, max_tokens=budget, **kwargs)
+    if response is None or not _content(response):
+        return response
+    cache_hit = bool(getattr(response, "_hidden_params", {}).get("cache_hit"))
+    prompt_tokens, completion_tokens = usage_tokens(response)
+    spent = {"prompt_tokens": 0 if cache_hit else prompt_tokens or 0,
+             "completion_tokens": 0 if cache_hit else completion_tokens or 0}
+    truncated = _finish_reason(response) == "length"
+    controller.observe(profile, budget, completion_tokens, truncated)
+
+    text = _content(response)
+    continuations = 0
+    cut_off = truncated
+    while cut_off and continuations < controller.max_continuations:
+        continuations += 1
+        follow_up = list(messages) + [{"role": "assistant", "content": text}, {"role": "user", "content": CONTINUE_PROMPT}]
+        more = await pool.acompletion(label=f"{label} (continuation)", messages=follow_up,
+                                      max_tokens=controller.continuation_tokens, **kwargs)
+        if more is None or not _content(more):
+            break
+        if not getattr(more, "_hidden_params", {}).get("cache_hit"):
+            more_prompt, more_completion = usage_tokens(more)
+            spent["prompt_tokens"] += more_prompt or 0
+            spent["completion_tokens"] += more_completion or 0
+        text += _content(more)
+        cut_off = _finish_reason(more) == "length"
+
+    response.choices[0].message.content = text
+    get_metrics().record("hint", profile, budget=budget, truncated=truncated, continuations=continuations,
+                         still_truncated=cut_off, cache_hit=cache_hit, **spent)
+    return response
+
+
+_shared_budget = None
+_shared_budget_lock = threading.Lock()
+
+
+def get_hint_budget(fixed=None, max_continuations=None):
+    """Returns the process-wide hint budget controller, creating it on first use."""
+    global _shared_budget
+    with _shared_budget_lock:
+        if _shared_budget is None:
+            _shared_budget = HintBudget(path=DEFAULT_SCALES_PATH)
+        if fixed is not None:
+            _shared_budget.fixed = fixed
+        if max_continuations is not None:
+            _shared_budget.max_continuations = max_continuations
+        return _shared_budget
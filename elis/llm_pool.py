@@ -0,0 +1,164 @@
+"""
+Async completion pool with rate-limit-aware scheduling.
+
+Every request is admitted through two token buckets, one for requests/min and
+one for tokens/min, sized to the provider's budget. If the provider still
+answers with a rate-limit error, the whole pool pauses and the bucket rates are
+cut, then creep back up on successful calls. This replaces the old pattern of
+each request sleeping on its own after a RateLimitError.
+"""
+import asyncio
+import time
+
+from elis.metrics import get_metrics
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token cost of a request (~4 characters per token plus the completion budget)."""
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst_seconds=10):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        # Allow a short burst instead of the full minute budget, which providers
+        # tend to reject when it arrives all at once.
+        self.capacity = max(1.0, self.max_rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        # Adjustments after the fact may push the level negative; that debt is
+        # paid back by the next refills.
+        self._refill()
+        self.level -= amount if amount < 0 else min(amount, self.capacity)
+
+    def slow_down(self, factor, min_fraction):
+        self.rate = max(self.max_rate * min_fraction, self.rate * factor)
+
+    def speed_up(self, factor):
+        self.rate = min(self.max_rate, self.rate * factor)
+
+
+class CompletionPool:
+    """
+    Runs litellm.acompletion calls with bounded concurrency and pool-wide
+    rate limiting. Returns None for a request once its retries are exhausted.
+    If a CompletionCache is given, hits are returned without touching the
+    rate limiter. Every call is recorded in the shared Metrics, with the time
+    spent waiting for admission as queue_seconds.
+    """
+
+    def __init__(self, max_concurrency=8, requests_per_minute=60, tokens_per_minute=100000,
+                 max_retries=3, retry_delay=10, backoff_factor=0.5, recovery_factor=1.05,
+                 min_rate_fraction=0.1, cache=None):
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.min_rate_fraction = min_rate_fraction
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._resume_at = 0.0
+        # asyncio primitives are created on first use so they bind to the running loop.
+        self._semaphore = None
+        self._admit_lock = None
+
+    def _ensure_primitives(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._admit_lock = asyncio.Lock()
+
+    async def _admit(self, est_tokens):
+        # Admission is serialized so requests are released in FIFO order.
+        async with self._admit_lock:
+            while True:
+                delay = max(
+                    self._resume_at - time.monotonic(),
+                    self.request_bucket.wait_time(1),
+                    self.token_bucket.wait_time(est_tokens),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(est_tokens)
+
+    def _on_rate_limit(self, delay):
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        for bucket in (self.request_bucket, self.token_bucket):
+            bucket.slow_down(self.backoff_factor, self.min_rate_fraction)
+
+    def _on_success(self, response, est_tokens):
+        for bucket in (self.request_bucket, self.token_bucket):
+            bucket.speed_up(self.recovery_factor)
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None) if usage else None
+        if total_tokens:
+            self.token_bucket.consume(total_tokens - est_tokens)
+
+    async def acompletion(self, label="", **kwargs):
+        import litellm
+
+        self._ensure_primitives()
+        start = time.perf_counter()
+        model = kwargs.get("model")
+        if self.cache is not None:
+            cache_key, cached = self.cache.lookup(kwargs)
+            if cached is not None:
+                get_metrics().record_completion(model, start, cached, cache_hit=True)
+                return cached
+        est_tokens = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        queue_seconds = 0.0
+        async with self._semaphore:
+            queue_seconds += time.perf_counter() - start
+            for attempt in range(self.max_retries):
+                admit_start = time.perf_counter()
+                await self._admit(est_tokens)
+                queue_seconds += time.perf_counter() - admit_start
+                try:
+                    print(f"    Attempting API call{label} (attempt {attempt + 1}/{self.max_retries})...")
+                    response = await litellm.acompletion(**kwargs)
+                except litellm.exceptions.RateLimitError as rle:
+                    print(f"    Rate limit error (attempt {attempt + 1}/{self.max_retries}): {rle}")
+                    if attempt < self.max_retries - 1:
+                        current_delay = self.retry_delay * (2 ** attempt)
+                        print(f"    Pausing the pool for {current_delay} seconds due to rate limit...")
+                        self._on_rate_limit(current_delay)
+                    else:
+                        print("    Max retries reached due to rate limit.")
+                        get_metrics().record_completion(model, start, None, retries=attempt, queue_seconds=queue_seconds)
+                        return None
+                except Exception as e:
+                    print(f"    Error during API call (attempt {attempt + 1}/{self.max_retries}): {type(e).__name__} - {e}")
+                    if attempt < self.max_retries - 1:
+                        print(f"    Retrying in {self.retry_delay} seconds...")
+                        await asyncio.sleep(self.retry_delay)
+                    else:
+                        print("    Max retries reached.")
+                        get_metrics().record_completion(model, start, None, retries=attempt, queue_seconds=queue_seconds)
+                        return None
+                else:
+                    self._on_success(response, est_tokens)
+                    get_metrics().record_completion(model, start, response, retries=attempt, queue_seconds=queue_seconds,
+                                                   messages=kwargs.get("messages"))
+                    if self.cache is not None:
+                        self.cache.store(cache_key, kwargs, response)
+                    return response
+        return None
@@ -0,0 +1,232 @@
+"""
+Per-call latency and token metrics.
+
+Completion calls (hint generation through CompletionPool, evaluation through
+the completion cache) and the answer-extraction and grading stages record
+one event each. Events are kept in memory for the end-of-run report and,
+if a path is given (--metrics or ELIS_METRICS_PATH), appended to a JSONL
+file as they happen:
+
+    {"ts": ..., "kind": "completion", "name": "ollama/llama3.2:1b", "seconds": 2.31,
+     "ttft": null, "prompt_tokens": 412, "completion_tokens": 388, "retries": 0,
+     "cache_hit": false, "queue_seconds": 0.0, "ok": true, "prompt_chars": 1650,
+     "cached_tokens": 0, "cached_estimated": true}
+    {"ts": ..., "kind": "stage", "name": "check_answer", "seconds": 0.004, "tier": "string"}
+    {"ts": ..., "kind": "hint", "name": "Llama-3.2-1B", "budget": 448, "truncated": false,
+     "continuations": 0, "prompt_tokens": 402, "completion_tokens": 291, ...}
+
+report() prints p50/p95/p99 tables per (kind, name), tokens/sec per model
+and tokens spent per hint profile (see elis/hint_budget.py), which separates provider latency, queueing and rate-limit waits, and
+grading time in a slow sweep.
+
+It also reports how much prompt prefill was served from a cache. Providers
+with prompt caching return usage.prompt_tokens_details.cached_tokens. Ollama
+instead reports only the prompt tokens it evaluated, so the reused KV-cache
+prefix is estimated from the prompt length, at the tokens per character of
+the model's densest call so far (its first call has nothing cached).
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+DEFAULT_METRICS_PATH = os.environ.get("ELIS_METRICS_PATH") or None
+TIMED_FIELDS = ("seconds", "ttft", "queue_seconds")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-p * len(sorted_values) // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def usage_tokens(response):
+    """(prompt_tokens, completion_tokens) from a litellm response, or (None, None)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None, None
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+def cached_tokens(response):
+    """Prompt tokens the provider served from its prompt cache, or None if it does not say."""
+    details = getattr(getattr(response, "usage", None), "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None)
+
+
+def prompt_chars(messages):
+    """Characters of message content in a request."""
+    return sum(len(m.get("content") or "") for m in messages or () if isinstance(m.get("content"), str))
+
+
+class Metrics:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._f = open(path, "a", encoding="utf-8") if path else None
+        self._timings = defaultdict(lambda: defaultdict(list))
+        self._models = defaultdict(lambda: defaultdict(float))
+        self._profiles = defaultdict(lambda: defaultdict(float))
+        self._tokens_per_char = defaultdict(float)
+
+    def record(self, kind, name, **fields):
+        event = {"ts": time.time(), "kind": kind, "name": name, **fields}
+        with self._lock:
+            for field in TIMED_FIELDS:
+                if fields.get(field) is not None:
+                    self._timings[(kind, name)][field].append(fields[field])
+            if kind == "completion":
+                totals = self._models[name]
+                totals["calls"] += 1
+                totals["cache_hits"] += bool(fields.get("cache_hit"))
+                totals["retries"] += fields.get("retries") or 0
+                totals["failures"] += not fields.get("ok", True)
+                # Throughput only counts calls that reached the model.
+                if not fields.get("cache_hit"):
+                    totals["seconds"] += fields.get("seconds") or 0.0
+                    totals["prompt_tokens"] += fields.get("prompt_tokens") or 0
+                    totals["completion_tokens"] += fields.get("completion_tokens") or 0
+                    totals["cached_tokens"] += fields.get("cached_tokens") or 0
+            elif kind == "hint":
+                totals = self._profiles[name]
+                totals["hints"] += 1
+                totals["cache_hits"] += bool(fields.get("cache_hit"))
+                totals["truncated"] += bool(fields.get("truncated"))
+                totals["continuations"] += fields.get("continuations") or 0
+                totals["budget"] += fields.get("budget") or 0
+                totals["prompt_tokens"] += fields.get("prompt_tokens") or 0
+                totals["completion_tokens"] += fields.get("completion_tokens") or 0
+            if self._f is not None:
+                self._f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+                self._f.flush()
+
+    def _estimate_cached(self, model, prompt_tokens, chars):
+        """Ollama: prompt tokens not evaluated, from the prompt length at the densest tokens/char seen."""
+        with self._lock:
+            ratio = self._tokens_per_char[model] = max(self._tokens_per_char[model], prompt_tokens / chars)
+        return max(0, round(chars * ratio) - prompt_tokens)
+
+    def record_completion(self, model, start, response, cache_hit=False, retries=0, queue_seconds=None, ttft=None,
+                          messages=None):
+        """
+        Records one completion call that started at time.perf_counter() ==
+        start. With the request's messages, prompt-cache savings are recorded
+        too (cached_tokens; cached_estimated when inferred for Ollama).
+        """
+        prompt_tokens, completion_tokens = usage_tokens(response)
+        fields = {}
+        if messages is not None and response is not None and not cache_hit:
+            chars = prompt_chars(messages)
+            fields["prompt_chars"] = chars
+            cached = cached_tokens(response)
+            if cached is not None:
+                fields["cached_tokens"] = cached
+            elif str(model).startswith("ollama") and prompt_tokens and chars:
+                fields["cached_tokens"] = self._estimate_cached(model, prompt_tokens, chars)
+                fields["cached_estimated"] = True
+        self.record(
+            "completion", model, seconds=time.perf_counter() - start, ttft=ttft,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, retries=retries,
+            cache_hit=cache_hit, queue_seconds=queue_seconds, ok=response is not None, **fields,
+        )
+
+    def timings(self, kind, name, field="seconds"):
+        """Sorted values recorded so far for one timed field of (kind, name)."""
+        with self._lock:
+            return sorted(self._timings.get((kind, name), {}).get(field, ()))
+
+    def totals(self, kind, name):
+        """Running totals for a model ("completion") or a hint profile ("hint")."""
+        with self._lock:
+            table = self._models if kind == "completion" else self._profiles
+            return dict(table.get(name, {}))
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """Times the enclosed block as a stage event."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record("stage", name, seconds=time.perf_counter() - start, **fields)
+
+    def report(self):
+        with self._lock:
+            timings = {key: {field: sorted(values) for field, values in fields.items()}
+                       for key, fields in self._timings.items()}
+            # Models that only had cache hits have no throughput totals.
+            models = {model: defaultdict(float, totals) for model, totals in self._models.items()}
+            profiles = {profile: dict(totals) for profile, totals in self._profiles.items()}
+        if not timings:
+            return "metrics: no events recorded"
+
+        lines = [f"{'kind':<11} {'name':<34} {'field':<14} {'count':>7} " + " ".join(f"{'p' + str(p):>9}" for p in PERCENTILES)]
+        for (kind, name), fields in sorted(timings.items()):
+            for field, values in fields.items():
+                cells = " ".join(f"{percentile(values, p):>9.3f}" for p in PERCENTILES)
+                lines.append(f"{kind:<11} {name:<34} {field:<14} {len(values):>7} {cells}")
+        if models:
+            lines.append("")
+            lines.append(f"{'model':<34} {'calls':>7} {'hits':>7} {'retries':>7} {'failed':>7} {'prompt tok':>11} {'compl tok':>11} {'tok/s':>8} {'prefix hit':>11}")
+            for model, t in sorted(models.items()):
+                rate = t["completion_tokens"] / t["seconds"] if t["seconds"] else 0.0
+                # Ollama's prompt_tokens exclude the reused prefix; OpenAI-style ones include it.
+                prefilled = t["prompt_tokens"] + t["cached_tokens"] if str(model).startswith("ollama") else t["prompt_tokens"]
+                saved = t["cached_tokens"] / prefilled if prefilled else 0.0
+                lines.append(
+                    f"{model:<34} {int(t['calls']):>7} {int(t['cache_hits']):>7} {int(t['retries']):>7} {int(t['failures']):>7}"
+                    f" {int(t['prompt_tokens']):>11} {int(t['completion_tokens']):>11} {rate:>8.1f} {saved:>11.1%}"
+                )
+        if profiles:
+            # Tokens spent per hint profile, continuations included; cache hits cost nothing.
+            lines.append("")
+            lines.append(f"{'hint profile':<34} {'hints':>7} {'hits':>7} {'cut off':>7} {'contd':>7} {'budget':>7} {'prompt tok':>11} {'compl tok':>11} {'tok/hint':>9}")
+            for profile, t in sorted(profiles.items(), key=lambda kv: str(kv[0])):
+                spent = t["prompt_tokens"] + t["completion_tokens"]
+                generated = t["hints"] - t["cache_hits"]
+                lines.append(
+                    f"{str(profile):<34} {int(t['hints']):>7} {int(t['cache_hits']):>7} {int(t['truncated']):>7} {int(t['continuations']):>7}"
+                    f" {t['budget'] / t['hints']:>7.0f} {int(t['prompt_tokens']):>11} {int(t['completion_tokens']):>11}"
+                    f" {spent / generated if generated else 0.0:>9.1f}"
+                )
+        if self.path:
+            lines.append(f"(events in {self.path})")
+        return "\n".join(lines)
+
+    def attach(self, path):
+        """Appends events from now on to `path`, for a recorder created without a file."""
+        with self._lock:
+            self.path = path
+            self._f = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_metrics(path=None):
+    """
+    Returns the process-wide recorder, creating it on first use. A recorder
+    without a file starts writing to `path` when one is first given; asking
+    for a different file than the one in use raises ValueError.
+    """
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = Metrics(path or DEFAULT_METRICS_PATH)
+        elif path and _shared_metrics.path is None:
+            _shared_metrics.attach(path)
+        elif path and os.path.abspath(path) != os.path.abspath(_shared_metrics.path):
+            raise ValueError(f"Metrics are already written to {_shared_metrics.path}, not {path}")
+        return _shared_metrics
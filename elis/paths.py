@@ -0,0 +1,15 @@
+"""
+Where elis keeps its state between runs: the completion cache, the results
+store, columnar dataset copies and the learned hint budget scales.
+
+The directory is $ELIS_CACHE_DIR, or .cache in the current directory. It
+is never inside the package, so an installed copy does not write into
+site-packages. Each store also takes its own path variable (e.g.
+ELIS_CACHE_PATH), which wins over this directory.
+"""
+import os
+
+
+def cache_dir():
+    """The directory for elis's state between runs."""
+    return os.path.abspath(os.environ.get("ELIS_CACHE_DIR") or os.path.join(os.getcwd(), ".cache"))
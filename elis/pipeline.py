@@ -0,0 +1,132 @@
+"""
+Streaming JSONL stages for long generation runs.
+
+Problems are read lazily, results are appended to the output as soon as they
+are ready (fsync'd periodically), and a restarted run skips every problem
+whose hash is already in the output. Memory stays constant and a crash only
+loses the requests that were in flight.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import time
+
+
+def problem_hash(problem_text):
+    """Stable key for a problem, insensitive to surrounding whitespace."""
+    return hashlib.sha256(problem_text.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def iter_jsonl(path):
+    """Yields (line_num, record) for each well-formed line of a JSONL file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except json.JSONDecodeError as je:
+                print(f"Error decoding JSON on line {line_num+1} in {path}: {je}")
+
+
+def iter_problems(path):
+    """
+    Yields (index, item) for a .jsonl or .json problem file. JSONL is read
+    lazily; a .json file has to be parsed whole and is then iterated.
+    """
+    if path.endswith(".jsonl"):
+        for index, (_, item) in enumerate(iter_jsonl(path)):
+            yield index, item
+    elif path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError(f"Expected a list of problems from {path}, but got {type(data)}")
+        yield from enumerate(data)
+    else:
+        raise ValueError(f"Unsupported input file format: {path}. Must be .jsonl or .json")
+
+
+def load_done_keys(path, key_fn):
+    """Collects key_fn(record) for every record already written to path."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    for _, record in iter_jsonl(path):
+        key = key_fn(record)
+        if key is not None:
+            done.add(key)
+    return done
+
+
+class CheckpointWriter:
+    """
+    Appends one JSON record per line. Every record is flushed to the OS right
+    away; fsync happens every `fsync_every` records or `fsync_interval` seconds.
+    """
+
+    def __init__(self, path, fsync_every=20, fsync_interval=30.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.written = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._repair_partial_line()
+        return self
+
+    def _repair_partial_line(self):
+        # A crash mid-write can leave an unterminated last line; start the next
+        # record on a fresh line so it stays parseable.
+        if self._f.tell() == 0:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                self._f.write("\n")
+
+    def write(self, record):
+        json.dump(record, self._f, ensure_ascii=False)
+        self._f.write("\n")
+        self._f.flush()
+        self.written += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def __exit__(self, *exc):
+        self.sync()
+        self._f.close()
+        self._f = None
+
+
+async def ordered_map(fn, items, window):
+    """
+    Async generator yielding (item, await fn(item)) in input order while keeping
+    at most `window` calls in flight. `items` is consumed lazily.
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append((item, asyncio.ensure_future(fn(item))))
+            if len(pending) >= window:
+                head, task = pending.popleft()
+                yield head, await task
+        while pending:
+            head, task = pending.popleft()
+            yield head, await task
+    finally:
+        for _, task in pending:
+            task.cancel()
@@ -0,0 +1,149 @@
+"""
+Per-problem evaluation results, so a re-run only evaluates what changed.
+
+evaluate() stores the grading statuses drawn for each problem under a hash
+of (model, prompt, ground truth, sampling parameters, GRADER_VERSION). On
+the next run a problem whose entry covers the requested samples is not
+generated or graded again; success rates are recomputed from the stored
+statuses. Editing one hint or adding a model therefore only evaluates the
+new (model, prompt) cells.
+
+Sample i is always drawn with seed i, so a stored entry is the prefix of any
+longer run: raising --n-samples draws only the missing seeds, and a run
+with fewer samples uses the first n stored ones. A TIMEOUT or WORKER_ERROR
+depends on load, not on the answer, so it is never stored: an entry ends
+before the first one, and those seeds are drawn and graded again next run.
+
+Set ELIS_RESULTS_BYPASS=1 (or pass bypass=True / --no-results-store) to
+skip lookups; fresh results are still written.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from elis.grading import CORRECT, GRADER_VERSION, TIMEOUT, TRUTH_PARSE_ERROR, WORKER_ERROR
+from elis.paths import cache_dir
+
+DEFAULT_RESULTS_PATH = os.environ.get(
+    "ELIS_RESULTS_PATH",
+    os.path.join(cache_dir(), "eval_results.sqlite"),
+)
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def result_key(model, prompt, truth, params):
+    """Hash of everything a problem's grading statuses depend on, except the number of samples."""
+    material = {"model": model, "prompt": prompt_hash(prompt), "truth": "" if truth is None else str(truth),
+                "params": params, "grader": GRADER_VERSION}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def reusable(statuses):
+    """The statuses before the first TIMEOUT or WORKER_ERROR, which a later run may reuse."""
+    for i, status in enumerate(statuses):
+        if status in (TIMEOUT, WORKER_ERROR):
+            return statuses[:i]
+    return statuses
+
+
+def is_complete(statuses, n, early_stop=False):
+    """Whether `statuses` already answer a run drawing n samples."""
+    return (len(statuses) >= n or TRUTH_PARSE_ERROR in statuses
+            or (early_stop and CORRECT in statuses))
+
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_RESULTS_PATH, bypass=False, commit_every=50):
+        self.path = path
+        self.bypass = bypass
+        self.commit_every = commit_every
+        self.reused = 0  # problems answered entirely from the store
+        self.extended = 0  # problems that had some of their samples stored
+        self.evaluated = 0  # problems with no stored samples
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, model TEXT, prompt_hash TEXT, statuses TEXT, updated REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Stored statuses for a key, or an empty list."""
+        with self._lock:
+            if self.bypass:
+                return []
+            row = self._conn.execute("SELECT statuses FROM results WHERE key = ?", (key,)).fetchone()
+        # Entries written before timeouts were left out may still contain them.
+        return reusable(json.loads(row[0])) if row is not None else []
+
+    def put(self, key, model, prompt, statuses):
+        """
+        Stores a problem's reusable() statuses, unless a longer run is already
+        stored (e.g. after a bypassed lookup).
+        """
+        statuses = reusable(statuses)
+        if not statuses:
+            return
+        with self._lock:
+            row = self._conn.execute("SELECT statuses FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None and len(reusable(json.loads(row[0]))) > len(statuses):
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, model, prompt_hash, statuses, updated) VALUES (?, ?, ?, ?, ?)",
+                (key, model, prompt_hash(prompt), json.dumps(statuses), time.time()),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def count(self, stored, n, early_stop=False):
+        """Tallies how much of a problem the stored statuses cover, for summary()."""
+        with self._lock:
+            if stored and is_complete(stored, n, early_stop):
+                self.reused += 1
+            elif stored:
+                self.extended += 1
+            else:
+                self.evaluated += 1
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def summary(self):
+        return (f"results store: {self.reused} problems reused, {self.extended} extended, "
+                f"{self.evaluated} evaluated [{self.path}]")
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_results_store(path=None, bypass=None):
+    """Returns the process-wide results store, creating it on first use."""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            if bypass is None:
+                bypass = os.environ.get("ELIS_RESULTS_BYPASS", "") not in ("", "0")
+            _shared_store = ResultsStore(path or DEFAULT_RESULTS_PATH, bypass=bypass)
+        elif bypass is not None:
+            _shared_store.bypass = bypass
+        return _shared_store
@@ -0,0 +1,51 @@
+"""
+Sampling for pass@k.
+
+Ollama ignores `n`, so each of the n samples for a problem is its own
+request (with its own seed), issued in parallel batches. From the n samples
+and c correct ones, pass@k is computed for every requested k with the
+unbiased estimator of Chen et al. (2021). When only pass@n is needed,
+sampling a problem stops at the first correct batch.
+"""
+from elis.grading import CORRECT, TRUTH_PARSE_ERROR
+
+
+def pass_at_k(n, c, k):
+    """Unbiased estimate of pass@k from n samples with c correct: 1 - C(n-c, k) / C(n, k)."""
+    if n - c < k:
+        return 1.0
+    # Product form of the binomial ratio; stays exact-ish for large n.
+    estimate = 1.0
+    for i in range(n - c + 1, n + 1):
+        estimate *= 1.0 - k / i
+    return 1.0 - estimate
+
+
+def mean_pass_at_k(counts, k):
+    """Mean pass@k over problems, given (n, c) per problem."""
+    if len(counts) == 0:
+        return float("nan")
+    return sum(pass_at_k(n, c, k) for n, c in counts) / len(counts)
+
+
+def draw_samples(sample_fn, grader, truth, n, batch_size, executor, early_stop=False, statuses=None):
+    """
+    Draws up to n samples in batches of `batch_size`. sample_fn(seed) returns
+    an extracted answer and runs on `executor`. Each answer is queued for
+    grading as soon as it arrives. Returns the grading statuses of the drawn
+    samples. Sampling stops early if the truth does not parse, or, with
+    early_stop, once a batch contains a correct answer. `statuses` are
+    already known results for seeds 0, 1, ...; drawing continues after them.
+    """
+    statuses = list(statuses or [])[:n]
+    if TRUTH_PARSE_ERROR in statuses or (early_stop and CORRECT in statuses):
+        return statuses
+    while len(statuses) < n:
+        seeds = range(len(statuses), min(n, len(statuses) + batch_size))
+        answer_futures = [executor.submit(sample_fn, seed) for seed in seeds]
+        grade_futures = [grader.submit(future.result(), truth) for future in answer_futures]
+        batch = [future.result() for future in grade_futures]
+        statuses.extend(batch)
+        if TRUTH_PARSE_ERROR in batch or (early_stop and CORRECT in batch):
+            break
+    return statuses
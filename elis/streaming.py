@@ -0,0 +1,157 @@
+"""
+Streaming completions that stop once the answer is complete.
+
+Small models often keep writing long after they have produced
+<answer>...</answer> or \\boxed{...}. In streaming mode the response is
+consumed chunk by chunk while AnswerStream watches for the answer, and the
+stream is closed as soon as the answer extract_answer would pick is complete.
+Closing the HTTP stream makes Ollama stop generating, which saves both
+latency and local GPU/CPU time.
+
+The answer extracted from a cut-off response is the same as from the full
+response. Cut-off responses are cached under their own key (with a
+stream_cutoff field), so a later non-streaming run does not get the
+truncated text. Streams that run to the end are cached under the plain
+request key.
+"""
+import time
+
+from elis.completion_cache import cache_key, get_cache
+from elis.extraction import ANSWER_OPEN, BOX_COMMANDS, FIRST, close_opener, find_opener
+from elis.metrics import get_metrics
+
+_MAX_OPENER = max(len(opener) for opener in (ANSWER_OPEN,) + BOX_COMMANDS)
+
+
+class AnswerStream:
+    """
+    Incremental version of extract_answer's "first" policy. The answer is
+    final once the leftmost opener in the text has closed: nothing before
+    that opener can change, and a full scan would try it first. An opener
+    that has not closed keeps the stream running; if it never closes, the
+    full text decides at the end. With the "last" policy a later answer can
+    always replace an earlier one, so the stream is never cut off.
+    """
+
+    def __init__(self, policy=FIRST):
+        self.policy = policy
+        self.text = ""
+        self.answer = None
+        self._scan_from = 0  # where to resume looking for an opener
+        self._pending = None  # (start, opener) of the leftmost opener
+
+    @property
+    def complete(self):
+        return self.answer is not None
+
+    def feed(self, chunk):
+        """Appends a chunk; returns True once the answer is complete."""
+        if not chunk:
+            return self.answer is not None
+        # Text after the answer is still kept; only the scanning stops.
+        self.text += chunk
+        if self.answer is not None or self.policy != FIRST:
+            return self.answer is not None
+        while True:
+            if self._pending is None:
+                start, opener = find_opener(self.text, self._scan_from)
+                if start < 0:
+                    # An opener may be split across chunks.
+                    self._scan_from = max(self._scan_from, len(self.text) - _MAX_OPENER + 1)
+                    return False
+                self._pending = (start, opener)
+            start, opener = self._pending
+            found = close_opener(self.text, start, opener)
+            if found is not None:
+                self.answer = found[0]
+                return True
+            rest = self.text[start + len(opener):].lstrip()
+            if opener is ANSWER_OPEN or not rest or rest[0] == "{":
+                return False
+            # A box command followed by something other than a brace is not an answer.
+            self._pending = None
+            self._scan_from = start + 1
+
+
+def _close(response):
+    # litellm's sync stream wrapper has no close(); closing the provider
+    # generator exits its `with client.stream(...)` and drops the connection.
+    stream = getattr(response, "completion_stream", None)
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+def stream_completion(stop_at_answer=True, policy=FIRST, **kwargs):
+    """
+    litellm.completion with stream=True, returned as a regular ModelResponse
+    with one choice. With stop_at_answer, the stream is closed once the
+    answer (under the given extraction policy) is complete. Goes through the
+    shared completion cache, where a cut-off request is also answered by a
+    full completion of the same request, and records time to first token in
+    the shared Metrics.
+    """
+    import litellm
+
+    stop_at_answer = stop_at_answer and policy == FIRST
+    request = dict(kwargs, n=1)
+    if stop_at_answer:
+        request["stream_cutoff"] = "answer"
+    cache = get_cache()
+    start = time.perf_counter()
+    key, cached = cache.lookup(request)
+    if cached is None and stop_at_answer:
+        # A full completion (non-streamed, or streamed to the end) holds the same first answer.
+        _, cached = cache.lookup(dict(kwargs, n=1))
+    if cached is not None:
+        get_metrics().record_completion(kwargs.get("model"), start, cached, cache_hit=True)
+        return cached
+
+    watcher = AnswerStream(policy)
+    ttft = None
+    chunks = 0
+    cut_off = False
+    finish_reason = None
+    usage = None
+    # Without include_usage litellm drops the final usage chunk (Ollama's prompt_eval_count).
+    stream = litellm.completion(**dict(kwargs, n=1, stream=True, stream_options={"include_usage": True}))
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            content = getattr(choice.delta, "content", None)
+            if not content:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            chunks += 1
+            if watcher.feed(content) and stop_at_answer:
+                finish_reason = "stop"
+                cut_off = True
+                break
+    finally:
+        _close(stream)
+
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None) or chunks  # roughly one token per chunk
+    usage_fields = {"prompt_tokens": prompt_tokens or 0, "completion_tokens": completion_tokens,
+                    "total_tokens": (prompt_tokens or 0) + completion_tokens}
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if cached is not None:
+        usage_fields["prompt_tokens_details"] = {"cached_tokens": cached}
+    response = litellm.ModelResponse(
+        model=kwargs.get("model"),
+        choices=[{"index": 0, "message": {"role": "assistant", "content": watcher.text}, "finish_reason": finish_reason or "stop"}],
+        usage=usage_fields,
+    )
+    get_metrics().record_completion(kwargs.get("model"), start, response, ttft=ttft, messages=kwargs.get("messages"))
+    if not cut_off:
+        # The stream ran to the end, so this is the full completion and is
+        # stored under the same key a non-streaming request uses.
+        request = dict(kwargs, n=1)
+        key = cache_key(request)
+    cache.store(key, request, response)
+    return response
@@ -0,0 +1,430 @@
+"""
+Sweep runner for the dataset x hint profile x model grid.
+
+A sweep config (JSON) lists the problem datasets, the hint profiles and the
+models to evaluate. The runner builds the stage graph
+
+    hints(dataset, profile) -> evaluate(dataset, profile, model) -> aggregate
+
+and runs it in one process: stages whose inputs are ready run concurrently,
+at most `concurrency` at a time and at most `limits[resource]` per resource
+("hints" shares the TogetherAI budget, "eval" the Ollama server). Grading
+happens inside the evaluate stage, as answers arrive. The aggregate stage
+writes results.json / results.csv and one plot.png-style figure per dataset.
+
+Every stage output has a <output>.stamp next to it with a fingerprint of the
+stage's parameters and of its input files. A stage whose stamp matches is up
+to date and is skipped; a stage that was interrupted with the same
+fingerprint resumes (hint files are appended to); a stage whose fingerprint
+changed starts over. Editing one hint file therefore re-runs only the
+cells that read it, and within those cells the results store
+(elis/results_store.py) limits generation and grading to the problems
+whose prompt changed.
+
+Profiles are "generic" (data/make_hint_data.py) or a key of
+STUDENT_MODEL_PROFILES (data/make_tailored_hints.py). `hint_files` maps a
+dataset and profile to an existing hint file, which is used instead of
+generating one. Relative paths are resolved against the config file.
+
+    python -m elis.sweep                      # the plot.png grid from the checked-in hint files
+    python -m elis.sweep --config sweep.json --dry-run
+    python -m elis.sweep --write-config sweep.json
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from elis import eval_small_models as E
+from elis.dataset import MappedColumn
+from elis.hint_budget import get_hint_budget
+from elis.sampling import mean_pass_at_k
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERIC_PROFILE = "generic"
+
+DEFAULT_CONFIG = {
+    "out_dir": ".cache/sweeps/plot",
+    "datasets": {"omnimath_100": "data/omnimath_100.jsonl"},
+    "profiles": [GENERIC_PROFILE, "Llama-3.2-1B", "Llama-3.2-3B"],
+    "hint_files": {
+        "omnimath_100": {
+            GENERIC_PROFILE: "data/omnimath_100_with_hints_v2.jsonl",
+            "Llama-3.2-1B": "data/omnimath_tailored_hints_llama1b.jsonl",
+            "Llama-3.2-3B": "data/omnimath_tailored_hints_llama3b.jsonl",
+        },
+    },
+    "models": list(E.all_models.values()),
+    # The legacy layout is the prompt the plot.png numbers were measured with.
+    "eval": {"n_samples": 1, "k": [1], "max_in_flight": E.DEFAULT_MAX_IN_FLIGHT, "stream": False,
+             "answer_policy": E.FIRST, "prompt_layout": E.LEGACY_LAYOUT},
+    "ollama_api_base": E.OLLAMA_API_BASE,
+    "concurrency": 4,
+    "limits": {"hints": 1, "eval": 2},
+}
+
+UP_TO_DATE = "up to date"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"  # an input stage failed
+WOULD_RUN = "would run"
+
+
+def _slug(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Stage:
+    """
+    One node of the sweep graph. `run(stage)` produces `output` from
+    `inputs` (files written by `deps` or given in the config); `params` are
+    everything else the output depends on.
+    """
+
+    def __init__(self, name, resource, output, run, params, inputs=(), deps=(), allow_failed_deps=False):
+        self.name = name
+        self.resource = resource
+        self.output = output
+        self.run = run
+        self.params = params
+        self.inputs = list(inputs)
+        self.deps = list(deps)
+        self.allow_failed_deps = allow_failed_deps
+
+    @property
+    def stamp_path(self):
+        return self.output + ".stamp"
+
+    def fingerprint(self):
+        inputs = {path: file_digest(path) for path in self.inputs if os.path.exists(path)}
+        blob = json.dumps({"params": self.params, "inputs": inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def read_stamp(self):
+        try:
+            with open(self.stamp_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_stamp(self, fingerprint, complete):
+        with open(self.stamp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "complete": complete, "ts": time.time()}, f)
+
+    def is_up_to_date(self, fingerprint=None):
+        stamp = self.read_stamp()
+        return bool(stamp and stamp.get("complete") and os.path.exists(self.output)
+                    and stamp.get("fingerprint") == (fingerprint or self.fingerprint()))
+
+
+def run_stage(stage, force=False):
+    """Runs one stage unless it is up to date; returns its status."""
+    fingerprint = stage.fingerprint()
+    stamp = stage.read_stamp()
+    if not force and stage.is_up_to_date(fingerprint):
+        print(f"[{UP_TO_DATE}] {stage.name}")
+        return UP_TO_DATE
+    if force or stamp is None or stamp.get("fingerprint") != fingerprint:
+        # Outputs from other parameters (or of unknown origin) are not resumed.
+        if os.path.exists(stage.output):
+            os.remove(stage.output)
+    os.makedirs(os.path.dirname(os.path.abspath(stage.output)), exist_ok=True)
+    stage.write_stamp(fingerprint, complete=False)
+    print(f"[run] {stage.name}")
+    start = time.perf_counter()
+    try:
+        stage.run(stage)
+    except Exception as e:
+        print(f"[{FAILED}] {stage.name}: {type(e).__name__}: {e}")
+        return FAILED
+    stage.write_stamp(fingerprint, complete=True)
+    print(f"[{DONE}] {stage.name} in {time.perf_counter() - start:.1f}s")
+    return DONE
+
+
+def check_limits(concurrency, limits):
+    """Raises ValueError unless concurrency and every per-resource limit are at least 1."""
+    if concurrency < 1 or any(limit < 1 for limit in limits.values()):
+        raise ValueError(f"concurrency and limits must be at least 1, got concurrency={concurrency}, limits={limits}")
+
+
+def run_graph(stages, concurrency=4, limits=None, force=False):
+    """
+    Runs every stage once its dependencies have finished, at most
+    `concurrency` at a time and `limits[resource]` per resource. Stages
+    depending on a failed stage are skipped, except those with
+    allow_failed_deps. Returns {stage name: status}. Raises ValueError for
+    limits below 1 and for stages that can never start.
+    """
+    limits = limits or {}
+    check_limits(concurrency, limits)
+    pending = {stage.name: stage for stage in stages}
+    status = {}
+    in_use = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or running:
+            progressed = False
+            for name, stage in list(pending.items()):
+                if len(running) >= concurrency:
+                    break
+                if any(dep not in status for dep in stage.deps):
+                    continue
+                if not stage.allow_failed_deps and any(status[dep] in (FAILED, SKIPPED) for dep in stage.deps):
+                    del pending[name]
+                    status[name] = SKIPPED
+                    print(f"[{SKIPPED}] {name}")
+                    progressed = True
+                    continue
+                if in_use.get(stage.resource, 0) >= limits.get(stage.resource, concurrency):
+                    continue
+                del pending[name]
+                in_use[stage.resource] = in_use.get(stage.resource, 0) + 1
+                running[executor.submit(run_stage, stage, force)] = stage
+            if not running:
+                if progressed:
+                    continue
+                # Nothing is running, started or skipped, so nothing will ever change.
+                raise ValueError(f"Stages with unknown or cyclic dependencies: {', '.join(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                in_use[stage.resource] -= 1
+                status[stage.name] = future.result()
+    return status
+
+
+def plan(stages):
+    """Statuses a run would have, without running anything: up to date, or would run."""
+    status = {}
+    for stage in stages:  # stages are built in dependency order
+        upstream_runs = any(status.get(dep) == WOULD_RUN for dep in stage.deps)
+        status[stage.name] = UP_TO_DATE if not upstream_runs and stage.is_up_to_date() else WOULD_RUN
+    return status
+
+
+def load_config(path=None):
+    """The sweep config, with defaults for missing keys and paths made absolute."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    base = REPO_ROOT
+    if path is not None:
+        with open(path, "r", encoding="utf-8") as f:
+            user = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        config.update({key: value for key, value in user.items() if key not in ("eval", "limits")})
+        config["eval"].update(user.get("eval", {}))
+        config["limits"].update(user.get("limits", {}))
+        if "hint_files" not in user and "datasets" in user:
+            config["hint_files"] = {}
+
+    def resolve(p):
+        return os.path.normpath(os.path.join(base, p))
+
+    config["out_dir"] = resolve(config["out_dir"])
+    config["datasets"] = {name: resolve(p) for name, p in config["datasets"].items()}
+    config["hint_files"] = {name: {profile: resolve(p) for profile, p in files.items()}
+                            for name, files in config.get("hint_files", {}).items()}
+    return config
+
+
+def _hint_stage(config, dataset, profile):
+    given = config["hint_files"].get(dataset, {}).get(profile)
+    if given is not None:
+        return given, None
+    output = os.path.join(config["out_dir"], "hints", dataset, f"{_slug(profile)}.jsonl")
+    input_path = config["datasets"][dataset]
+    if profile == GENERIC_PROFILE:
+        from data import make_hint_data as H
+
+        params = {"model": H.LLM_MODEL, "prompt": inspect.getsource(H.generate_hint_for_problem),
+                  "budget": get_hint_budget().settings(H.HINT_PROFILE)}
+
+        def run(stage):
+            _, failed = H.generate_hint_file(input_path, stage.output)
+            if failed:
+                raise RuntimeError(f"{failed} problems without a hint; re-run to retry them")
+    else:
+        from data import make_tailored_hints as T
+
+        if profile not in T.STUDENT_MODEL_PROFILES:
+            raise ValueError(f"Unknown profile {profile!r}: use {GENERIC_PROFILE!r}, one of {list(T.STUDENT_MODEL_PROFILES)}, or give a hint file")
+        params = {"model": T.LLM_MODEL, "prefix": T.hint_prompt_prefix(profile),
+                  "prompt": inspect.getsource(T.generate_hint_for_problem), "budget": get_hint_budget().settings(profile)}
+
+        def run(stage):
+            failed = T.generate_tailored_hints([profile], {profile: stage.output}, input_path)[profile]
+            if failed:
+                raise RuntimeError(f"{failed} problems without a hint; re-run to retry them")
+    return output, Stage(f"hints {dataset}/{profile}", "hints", output, run, params, inputs=[input_path])
+
+
+def evaluate_cell(stage, hints_path, model, settings):
+    """Evaluates one model on one hint file and writes the per-problem (drawn, correct) counts."""
+    data = E.load_data(hints_path)
+    data["answer"] = data["final_answer_gt"]
+    get_prompt = functools.partial(E.get_prompt, layout=settings["prompt_layout"])
+    data["prompt"] = MappedColumn(get_prompt, data["question"], data["hint"])
+    counts = E.evaluate(
+        model, data, n_samples=settings["n_samples"], max_in_flight=settings["max_in_flight"],
+        stream=settings["stream"], policy=settings["answer_policy"],
+    )
+    with open(stage.output, "w", encoding="utf-8") as f:
+        json.dump({"model": model, "hints": hints_path, "settings": settings, "counts": counts.tolist()}, f)
+
+
+def aggregate(stage, cells, ks, out_dir):
+    """Writes results.json, results.csv and one figure per dataset from the evaluated cells."""
+    rows = []
+    for (dataset, profile, model), path in cells.items():
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            counts = json.load(f)["counts"]
+        row = {"dataset": dataset, "profile": profile, "model": model, "problems": len(counts)}
+        for k in ks:
+            row[f"pass@{k}"] = mean_pass_at_k(counts, k) if counts else float("nan")
+        rows.append(row)
+    with open(stage.output, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    with open(os.path.join(out_dir, "results.csv"), "w", encoding="utf-8") as f:
+        columns = ["dataset", "profile", "model", "problems"] + [f"pass@{k}" for k in ks]
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join(str(row[c]) for c in columns) + "\n")
+    models = list(dict.fromkeys(model for _, _, model in cells))
+    for dataset in dict.fromkeys(row["dataset"] for row in rows):
+        plot_results([row for row in rows if row["dataset"] == dataset], f"pass@{ks[0]}",
+                     os.path.join(out_dir, f"{_slug(dataset)}.png"), title=dataset, models=models)
+
+
+def plot_results(rows, metric, path, title=None, models=None):
+    """One line per hint profile over the models (in the given order), like plot.png."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print(f"matplotlib is not installed; skipping {path}")
+        return
+    models = models or list(dict.fromkeys(row["model"] for row in rows))
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for profile, marker in zip(dict.fromkeys(row["profile"] for row in rows), "oDs^v<>ph*"):
+        by_model = {row["model"]: 100 * row[metric] for row in rows if row["profile"] == profile}
+        xs = [i for i, model in enumerate(models) if model in by_model]
+        ys = [by_model[models[i]] for i in xs]
+        ax.plot(xs, ys, marker=marker, markersize=10, linewidth=3, alpha=0.85, label=f"{profile} hints")
+        for x, y in zip(xs, ys):
+            ax.annotate(f"{y:.1f}%", (x, y), textcoords="offset points", xytext=(0, 10), ha="center", fontsize=11, color="gray")
+    ax.set_xticks(range(len(models)))
+    ax.set_xticklabels([model.split("/", 1)[-1] for model in models], fontsize=13)
+    ax.set_xlabel("Model", fontsize=15, labelpad=10)
+    ax.set_ylabel(f"Success Rate (%, {metric})", fontsize=15)
+    ax.set_ylim(bottom=0)
+    ax.set_title(title or "", fontsize=18, fontweight="bold")
+    ax.grid(axis="y", linestyle="--", linewidth=0.5, alpha=0.7)
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+    ax.legend(frameon=False, fontsize=13)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+
+def build_stages(config):
+    """The sweep graph in dependency order: hint stages, evaluate stages, then aggregate."""
+    stages, eval_names, cells = [], [], {}
+    settings = dict(config["eval"])
+    ks = sorted(set(settings.pop("k")))
+    if max(ks) > settings["n_samples"]:
+        raise ValueError("every k must be at most eval.n_samples")
+    for dataset in config["datasets"]:
+        for profile in config["profiles"]:
+            hints_path, hint_stage = _hint_stage(config, dataset, profile)
+            deps = []
+            if hint_stage is not None:
+                stages.append(hint_stage)
+                deps = [hint_stage.name]
+            for model in config["models"]:
+                model = E.resolve_model(model)
+                output = os.path.join(config["out_dir"], "evals", dataset, _slug(profile), f"{_slug(model)}.json")
+                run = functools.partial(evaluate_cell, hints_path=hints_path, model=model, settings=settings)
+                stage = Stage(f"evaluate {dataset}/{profile}/{model}", "eval", output, run,
+                              {"model": model, "settings": settings}, inputs=[hints_path], deps=deps)
+                stages.append(stage)
+                eval_names.append(stage.name)
+                cells[(dataset, profile, model)] = output
+    out_dir = config["out_dir"]
+    stages.append(Stage(
+        "aggregate", "aggregate", os.path.join(out_dir, "results.json"),
+        functools.partial(aggregate, cells=cells, ks=ks, out_dir=out_dir),
+        {"ks": ks, "cells": sorted(f"{d}/{p}/{m}" for d, p, m in cells)},
+        inputs=list(cells.values()), deps=eval_names, allow_failed_deps=True,
+    ))
+    return stages
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, default=None, help="Sweep config JSON (default: the plot.png grid)")
+    parser.add_argument("--write-config", type=str, default=None, help="Write the default config to this file and exit")
+    parser.add_argument("--dry-run", action="store_true", help="List which stages are up to date and which would run")
+    parser.add_argument("--force", action="store_true", help="Re-run every stage, even if it is up to date")
+    parser.add_argument("--concurrency", type=int, default=None, help="Stages running at once (overrides the config)")
+    parser.add_argument("--grade-workers", type=int, default=None, help="Grading processes (default: one per core)")
+    parser.add_argument("--metrics", type=str, default=None, help="Append per-call metrics as JSONL to this file")
+    args = parser.parse_args(argv)
+
+    if args.write_config:
+        # Paths are written relative to the new file, which is where they are resolved from.
+        config = load_config()
+        base = os.path.dirname(os.path.abspath(args.write_config))
+        relative = functools.partial(os.path.relpath, start=base)
+        config["out_dir"] = relative(config["out_dir"])
+        config["datasets"] = {name: relative(p) for name, p in config["datasets"].items()}
+        config["hint_files"] = {name: {profile: relative(p) for profile, p in files.items()}
+                                for name, files in config["hint_files"].items()}
+        with open(args.write_config, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        print(f"Default sweep config written to {args.write_config}")
+        return
+    config = load_config(args.config)
+    if args.concurrency:
+        config["concurrency"] = args.concurrency
+    check_limits(config["concurrency"], config["limits"])
+    stages = build_stages(config)
+
+    if args.dry_run:
+        for name, status in plan(stages).items():
+            print(f"[{status}] {name}")
+        return
+
+    E.get_metrics(args.metrics)
+    E.get_grading_pool(workers=args.grade_workers)
+    E.OLLAMA_API_BASE = config["ollama_api_base"]
+    eval_slots = min(config["concurrency"], config["limits"].get("eval", config["concurrency"]))
+    E.configure_http_pool(config["eval"]["max_in_flight"] * eval_slots)
+    status = run_graph(stages, config["concurrency"], config["limits"], force=args.force)
+
+    print()
+    for stage in stages:
+        print(f"{status[stage.name]:<11} {stage.name}")
+    print(f"\nResults in {config['out_dir']}")
+    print(E.get_cache().summary())
+    print(E.get_metrics().report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+import os
+
+# Tests run offline; litellm would otherwise try to fetch its model cost map on import.
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
@@ -0,0 +1,40 @@
+import pytest
+
+from elis import completion_cache
+from elis.backends import Backend, CompletionRequest
+from elis.completion_cache import CompletionCache
+
+
+class EchoBackend(Backend):
+    name = "echo"
+
+    def __init__(self):
+        super().__init__()
+        self.generated = []
+
+    def _generate(self, model, requests):
+        self.generated.extend(requests)
+        return [f"{r.prompt}#{r.seed}" for r in requests]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        Backend()
+
+    class Incomplete(Backend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_only_uncached_requests_are_generated(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+    monkeypatch.setattr(completion_cache, "_shared_cache", cache)
+    backend = EchoBackend()
+    assert backend.generate("m", [CompletionRequest("a", 0), CompletionRequest("b", 0)]) == ["a#0", "b#0"]
+    requests = [CompletionRequest("a", 0), CompletionRequest("a", 1), CompletionRequest("b", 0)]
+    assert backend.generate("m", requests) == ["a#0", "a#1", "b#0"]
+    assert backend.generated[2:] == [CompletionRequest("a", 1)]
+    assert CompletionRequest("c").seed is None
+    cache.close()
@@ -0,0 +1,20 @@
+from elis.completion_cache import CompletionCache
+
+
+def test_running_total_tracks_replacements_and_eviction(tmp_path):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"), max_bytes=1000)
+    for i in range(5):
+        cache.put(f"k{i}", "m", {"text": "x" * 100})
+    cache.put("k0", "m", {"text": "y" * 150})
+    assert cache._total == cache._stored_bytes()
+    assert cache.evictions == 0
+
+    for i in range(5, 12):
+        cache.put(f"k{i}", "m", {"text": "x" * 100})
+    assert cache.evictions > 0
+    assert cache._total == cache._stored_bytes() <= 1000
+    assert cache.get("k11") is not None and cache.get("k1") is None
+    cache.close()
+
+    reopened = CompletionCache(str(tmp_path / "completions.sqlite"), max_bytes=1000)
+    assert reopened._total == cache._total
@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from elis.dataset import open_dataset
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "problems.jsonl"
+    path.write_text("".join(json.dumps({"problem": f"p{i}", "answer": str(i)}) + "\n" for i in range(10)))
+    return open_dataset(str(path), store_dir=str(tmp_path / "store"))
+
+
+@pytest.mark.parametrize("start, stop", [(2, 5), (-5, None), (-3, -1), (-20, 3), (7, 100), (8, 2), (0, -20)])
+def test_rows_match_python_slices(dataset, start, stop):
+    view = dataset.rows(start, stop)
+    assert list(view["answer"]) == [str(i) for i in range(10)][start:stop]
+
+
+def test_rows_of_a_view_stay_inside_it(dataset):
+    view = dataset.rows(2, 8).rows(-2)
+    assert list(view["problem"]) == ["p6", "p7"]
@@ -0,0 +1,38 @@
+import httpx
+import pytest
+
+from benchmarks.mock_server import MockServer
+from elis import completion_cache
+from elis import eval_small_models as E
+from elis.completion_cache import CompletionCache
+
+
+class CountingTransport(httpx.HTTPTransport):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+
+    def handle_request(self, request):
+        self.requests += 1
+        return super().handle_request(request)
+
+
+@pytest.fixture
+def evaluation(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"), bypass=True)
+    monkeypatch.setattr(completion_cache, "_shared_cache", cache)
+    with MockServer(lambda prompt, seed: f"<answer>{seed}</answer>", latency=0) as server:
+        monkeypatch.setattr(E, "OLLAMA_API_BASE", server.url)
+        yield server
+    cache.close()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_requests_go_through_the_configured_http_pool(evaluation, monkeypatch, stream):
+    monkeypatch.setattr(E, "_http_client", None)
+    E.configure_http_pool(2)
+    transport = CountingTransport()
+    E._http_client.client = httpx.Client(transport=transport)
+    for seed in range(3):
+        assert E.get_responses("ollama/llama3.2:1b", "What is 3+4?", seed=seed, stream=stream) == [f"<answer>{seed}</answer>"]
+    assert transport.requests == evaluation.requests == 3
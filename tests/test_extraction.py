@@ -0,0 +1,50 @@
+import pytest
+
+from elis.extraction import FIRST, LAST, extract_answer, extract_answers
+
+CASES = [
+    # (response, first answer, last answer)
+    ("<answer>7</answer>", "7", "7"),
+    ("The answer is \\boxed{\\frac{1}{2}}.", "\\frac{1}{2}", "\\frac{1}{2}"),
+    ("\\boxed{\\sqrt{\\frac{a}{b}}}", "\\sqrt{\\frac{a}{b}}", "\\sqrt{\\frac{a}{b}}"),
+    ("\\fbox{42}", "42", "42"),
+    ("\\boxed {x+1}", "x+1", "x+1"),
+    ("\\boxed{ 3 }", "3", "3"),
+    # Escaped braces do not count towards nesting.
+    ("\\boxed{\\{1,2\\}}", "\\{1,2\\}", "\\{1,2\\}"),
+    ("\\boxed{a\\}b}", "a\\}b", "a\\}b"),
+    # An answer tag that only wraps a boxed answer yields the boxed content.
+    ("<answer>\\boxed{7}</answer>", "7", "7"),
+    ("<answer> \\fbox{\\frac{1}{2}} </answer>", "\\frac{1}{2}", "\\frac{1}{2}"),
+    ("<answer>\\boxed{1} and \\boxed{2}</answer>", "\\boxed{1} and \\boxed{2}", "\\boxed{1} and \\boxed{2}"),
+    # Unclosed openers are skipped.
+    ("\\boxed{1 and then <answer>5</answer>", "5", "5"),
+    ("<answer>5 and no close \\boxed{6}", "6", "6"),
+    ("\\boxed{\\frac{1}{2}", None, None),
+    ("<answer>7", None, None),
+    ("\\boxed 7", None, None),
+    ("\\boxed{1} \\boxed{2", "1", "1"),
+    # first vs last
+    ("<answer>3</answer> on reflection \\boxed{4}", "3", "4"),
+    ("\\boxed{1}\\boxed{2}\\boxed{3}", "1", "3"),
+    ("<answer>\\boxed{7}</answer> \\boxed{8}", "7", "8"),
+    ("no answer here", None, None),
+    ("", None, None),
+    (None, None, None),
+]
+
+
+@pytest.mark.parametrize("text, first, last", CASES)
+def test_extract_answer(text, first, last):
+    assert extract_answer(text, FIRST) == first
+    assert extract_answer(text, LAST) == last
+
+
+def test_extract_answers_keeps_order():
+    texts = [case[0] for case in CASES]
+    assert extract_answers(texts, LAST) == [case[2] for case in CASES]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        extract_answer("\\boxed{1}", "middle")
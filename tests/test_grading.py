@@ -0,0 +1,66 @@
+import latex2sympy2
+import pytest
+
+from elis import grading
+
+
+def test_transient_parse_failure_is_not_memoized(monkeypatch):
+    latex = "\\frac{7}{13}+y"
+    real = latex2sympy2.latex2sympy
+
+    def out_of_memory(_):
+        raise MemoryError
+
+    monkeypatch.setattr(latex2sympy2, "latex2sympy", out_of_memory)
+    with pytest.raises(MemoryError):
+        grading._parse(latex)
+    monkeypatch.setattr(latex2sympy2, "latex2sympy", real)
+    assert grading._parse(latex) is not grading._UNPARSEABLE
+
+
+def test_parse_errors_are_memoized(monkeypatch):
+    latex = "\\frac{1}{"
+    assert grading._parse(latex) is grading._UNPARSEABLE
+
+    def unexpected(_):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(latex2sympy2, "latex2sympy", unexpected)
+    assert grading._parse(latex) is grading._UNPARSEABLE
+
+
+def test_dead_worker_is_not_counted_as_a_timeout():
+    import multiprocessing
+
+    with grading.GradingPool(workers=1) as pool:
+        assert pool.submit("1", "1").result() == grading.CORRECT  # the worker is up
+        for child in multiprocessing.active_children():
+            child.kill()
+            child.join()
+        assert pool.submit("x", "y").result() == grading.WORKER_ERROR
+        assert pool.submit("2", "2").result() == grading.CORRECT
+        assert pool.tier_counts[grading.TIER_WORKER_ERROR] == 1
+        assert pool.tier_counts[grading.TIER_TIMEOUT] == 0
+
+
+def test_a_worker_that_cannot_be_replaced_does_not_hang_the_pool(monkeypatch):
+    import multiprocessing
+
+    monkeypatch.setattr(grading, "SPAWN_BACKOFF", 0.01)
+    with grading.GradingPool(workers=1) as pool:
+        assert pool.submit("1", "1").result() == grading.CORRECT  # the worker is up
+        spawn = pool._spawn
+
+        def fail():
+            raise EOFError("worker died during warm-up")
+
+        pool._spawn = fail
+        for child in multiprocessing.active_children():
+            child.kill()
+            child.join()
+        assert pool.submit("x", "y").result(timeout=10) == grading.WORKER_ERROR
+        assert pool.submit("x", "z").result(timeout=10) == grading.WORKER_ERROR
+        assert pool._slots[0].is_alive()
+
+        pool._spawn = spawn
+        assert pool.submit("x", "y").result(timeout=30) == grading.INCORRECT
@@ -0,0 +1,70 @@
+"""
+The tiered grader must give the verdicts of the checker it replaced,
+simplify(latex2sympy(ans) - latex2sympy(truth)) == 0 run in a fresh
+process per truth, on every pair.
+The regression set pairs each Omni-MATH answer with itself, spacing
+variants, another problem's answer and common answer forms.
+"""
+import json
+import os
+import random
+
+import latex2sympy2
+import pytest
+
+from elis.grading import CORRECT, TRUTH_PARSE_ERROR, _reset_parser_state, grade_answer_tiered
+
+# latex2sympy2 keeps variables in module globals; both checkers start each parse from the import-time state.
+_reset_parser_state()
+FRESH_STATE = (dict(latex2sympy2.var), dict(latex2sympy2.variances))
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "omnimath_100.jsonl")
+FORMS = [
+    "\\frac{1}{2}", "0.5", "1/2", "\\dfrac{1}{2}", " 1 / 2 ", "2^{10}", "1024", "\\sqrt{2}", "2^{1/2}", "\\sqrt{8}/2",
+    "3", "3.0", "-3", "\\pi", "\\frac{\\pi}{2}", "x^2+2x+1", "(x+1)^2", "x+1", "\\{1,2\\}", "\\text{No}", None, "",
+    "\\frac{1}{3}", "0.333", "\\left(\\frac{1}{2}\\right)", "\\boxed{3}", "10^{-3}", "0.001", "e^{i\\pi}", "-1",
+    "2\\sqrt{2}", "\\sqrt{8}", "n(n+1)/2", "\\frac{n^2+n}{2}", "\\frac{n(n+1)}{2}",
+]
+
+
+def regression_pairs():
+    rng = random.Random(0)
+    with open(DATASET, "r", encoding="utf-8") as f:
+        truths = [json.loads(line)["answer"] for line in f if line.strip()]
+    pairs = []
+    for truth in truths + [form for form in FORMS[:20] if form is not None]:
+        candidates = [truth, truth.replace(" ", ""), f" {truth} ", rng.choice(truths)] + rng.sample(FORMS, 6)
+        pairs.extend((candidate, truth) for candidate in candidates)
+    return pairs
+
+
+def old_verdict(ans, truth):
+    """The pre-tier checker: True/False per answer, None if the truth does not parse."""
+    from latex2sympy2 import latex2sympy
+    from sympy import simplify
+
+    latex2sympy2.var, latex2sympy2.variances = dict(FRESH_STATE[0]), dict(FRESH_STATE[1])
+    try:
+        truth_expr = latex2sympy(truth)
+    except Exception:
+        return None
+    if ans is None:
+        return False
+    try:
+        return bool(simplify(latex2sympy(ans) - truth_expr) == 0)
+    except Exception:
+        return False
+
+
+def test_regression_set_size():
+    assert len(regression_pairs()) == 1200
+
+
+@pytest.mark.parametrize("ans, truth", regression_pairs())
+def test_tiered_verdict_matches_old_checker(ans, truth):
+    expected = old_verdict(ans, truth)
+    status, tier = grade_answer_tiered(ans, truth)
+    if expected is None:
+        assert status == TRUTH_PARSE_ERROR
+    else:
+        assert (status == CORRECT) == expected, (status, tier)
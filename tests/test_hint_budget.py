@@ -0,0 +1,70 @@
+import asyncio
+
+from elis.hint_budget import MIN_OBSERVATIONS, HintBudget
+
+ITEM = {"difficulty": 5.0, "domain": ["Mathematics -> Algebra"]}
+
+# The prompt make_tailored_hints.py sent with max_tokens=500 before per-problem budgets.
+OLD_TAILORED_PROMPT = """
+You are an expert math tutor. Your primary task is to provide step-by-step hints that would guide a student AI towards the solution of the given math question.
+
+**The student AI you are generating hints for has the following properties:
+{description}**
+
+Please carefully tailor your hints to be perfectly suitable for this specific type of student AI, considering its described capabilities and limitations.
+
+IMPORTANT - Instructions for generating these tailored hints:
+1.  Do NOT reveal the final answer or any final numerical/symbolic result of the overall problem in your hints.
+2.  Focus on the problem-solving process, key concepts, or intermediate steps, adapting the complexity according to the student AI's properties.
+3.  Break down the problem into steps that are appropriately sized for the student AI's capabilities. For less capable AIs, this means very small, atomic steps. For more capable ones, hints can be more consolidated.
+4.  Hints must be progressive, leading the student AI logically and clearly.
+5.  Keep hints concise and use language appropriate for the described student AI. Ensure clarity above all.
+
+Question:
+{question}
+
+Hints (tailored for the student AI with properties: {description}):
+"""
+
+
+def test_budgets_do_not_change_during_a_run(tmp_path):
+    controller = HintBudget(path=str(tmp_path / "scales.json"))
+    before = controller.budget(ITEM, "generic")
+    for _ in range(MIN_OBSERVATIONS):
+        controller.observe("generic", before, before, truncated=True)
+    assert controller.budget(ITEM, "generic") == before
+    assert controller.learned_scales()["generic"] > 1.0
+
+
+def test_learned_scales_are_loaded_by_the_next_run(tmp_path):
+    path = str(tmp_path / "scales.json")
+    first = HintBudget(path=path)
+    budget = first.budget(ITEM, "generic")
+    for _ in range(MIN_OBSERVATIONS):
+        first.observe("generic", budget, budget, truncated=True)
+    first.save()
+
+    second = HintBudget(path=path)
+    assert second.scale("generic") == first.learned_scales()["generic"]
+    assert second.budget(ITEM, "generic") > budget
+    assert second.budget(ITEM, "other") == budget
+    assert second.settings("generic") != first.settings("generic")
+
+
+def test_fixed_budget_sends_the_old_tailored_request(monkeypatch):
+    from data import make_tailored_hints as T
+    from elis import hint_budget
+
+    monkeypatch.setattr(hint_budget, "_shared_budget", HintBudget(fixed=500, max_continuations=0))
+    sent = []
+
+    class Pool:
+        async def acompletion(self, label="", **kwargs):
+            sent.append(kwargs)
+            return None
+
+    profile = next(iter(T.STUDENT_MODEL_PROFILES))
+    asyncio.run(T.generate_hint_for_problem("What is 1+1?", profile, Pool(), ITEM))
+    description = T.STUDENT_MODEL_PROFILES[profile]["description"]
+    assert sent == [{"model": T.LLM_MODEL, "max_tokens": 500, "temperature": 0.3,
+                     "messages": [{"role": "user", "content": OLD_TAILORED_PROMPT.format(description=description, question="What is 1+1?")}]}]
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from elis import metrics
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "_shared_metrics", None)
+    yield
+    if metrics._shared_metrics is not None:
+        metrics._shared_metrics.close()
+
+
+def test_a_different_path_raises(fresh_metrics, tmp_path):
+    first = str(tmp_path / "first.jsonl")
+    recorder = metrics.get_metrics(first)
+    assert metrics.get_metrics(first) is recorder
+    assert metrics.get_metrics() is recorder
+    with pytest.raises(ValueError):
+        metrics.get_metrics(str(tmp_path / "second.jsonl"))
+
+
+def test_a_path_is_attached_to_a_recorder_without_one(fresh_metrics, tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "DEFAULT_METRICS_PATH", None)
+    recorder = metrics.get_metrics()
+    path = tmp_path / "events.jsonl"
+    assert metrics.get_metrics(str(path)) is recorder
+    recorder.record("stage", "check_answer", seconds=0.5)
+    recorder.close()
+    assert json.loads(path.read_text())["name"] == "check_answer"
@@ -0,0 +1,14 @@
+import os
+
+from elis.paths import cache_dir
+
+
+def test_cache_dir_defaults_to_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.delenv("ELIS_CACHE_DIR", raising=False)
+    monkeypatch.chdir(tmp_path)
+    assert cache_dir() == os.path.join(str(tmp_path), ".cache")
+
+
+def test_cache_dir_follows_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("ELIS_CACHE_DIR", str(tmp_path / "state"))
+    assert cache_dir() == str(tmp_path / "state")
@@ -0,0 +1,41 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from elis.grading import CORRECT, INCORRECT, TIMEOUT, WORKER_ERROR
+from elis.results_store import ResultsStore, is_complete
+from elis.sampling import draw_samples
+
+
+class Grader:
+    def submit(self, ans, truth):
+        future = Future()
+        future.set_result(CORRECT if ans == truth else INCORRECT)
+        return future
+
+
+def test_statuses_from_a_timeout_on_are_not_stored(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.put("k", "m", "prompt", [CORRECT, INCORRECT, TIMEOUT, CORRECT])
+    assert store.get("k") == [CORRECT, INCORRECT]
+    assert not is_complete(store.get("k"), 4)
+
+    store.put("w", "m", "prompt", [WORKER_ERROR, CORRECT])
+    assert store.get("w") == []
+
+
+def test_stored_timeouts_are_drawn_again(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    # An entry written before timeouts were left out.
+    store._conn.execute("INSERT INTO results (key, model, prompt_hash, statuses, updated) VALUES (?, ?, ?, ?, ?)",
+                        ("k", "m", "p", '["incorrect", "timeout", "correct"]', 0))
+    drawn = []
+
+    def sample(seed):
+        drawn.append(seed)
+        return "7"
+
+    with ThreadPoolExecutor(2) as executor:
+        statuses = draw_samples(sample, Grader(), "7", 3, 2, executor, statuses=store.get("k"))
+    assert drawn == [1, 2]
+    assert statuses == [INCORRECT, CORRECT, CORRECT]
+    store.put("k", "m", "p", statuses)
+    assert store.get("k") == statuses
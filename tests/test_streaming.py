@@ -0,0 +1,69 @@
+import pytest
+
+from benchmarks.mock_server import MockServer
+from elis import completion_cache
+from elis.completion_cache import CompletionCache, cache_key
+from elis.extraction import LAST
+from elis.streaming import AnswerStream, stream_completion
+
+CHUNKS = ["The answer is <ans", "wer>7</answer>", " and more text", " \\boxed{8}"]
+FULL_TEXT = "".join(CHUNKS)
+
+
+def test_answer_stream_keeps_text_after_the_answer():
+    stream = AnswerStream()
+    done = [stream.feed(chunk) for chunk in CHUNKS]
+    assert done == [False, True, True, True]
+    assert stream.answer == "7"
+    assert stream.text == FULL_TEXT
+
+
+def test_answer_stream_last_policy_never_completes():
+    stream = AnswerStream(LAST)
+    assert not any(stream.feed(chunk) for chunk in CHUNKS)
+    assert stream.text == FULL_TEXT
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = CompletionCache(str(tmp_path / "completions.sqlite"))
+    monkeypatch.setattr(completion_cache, "_shared_cache", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def server():
+    with MockServer(lambda prompt, seed: FULL_TEXT, latency=0) as server:
+        yield server
+
+
+def _request(server):
+    return {"model": "ollama/llama3.2:1b", "messages": [{"role": "user", "content": "What is 3+4?"}],
+            "api_base": server.url, "seed": 0}
+
+
+def test_full_stream_is_cached_under_the_plain_key(cache, server):
+    request = _request(server)
+    response = stream_completion(stop_at_answer=False, **request)
+    assert response.choices[0].message.content == FULL_TEXT
+    assert cache.get(cache_key(dict(request, n=1)))["choices"][0]["message"]["content"] == FULL_TEXT
+    assert cache.get(cache_key(dict(request, n=1, stream_cutoff="answer"))) is None
+
+
+def test_cut_off_stream_is_cached_under_its_own_key(cache, server):
+    request = _request(server)
+    response = stream_completion(stop_at_answer=True, **request)
+    text = response.choices[0].message.content
+    assert "<answer>7</answer>" in text and "\\boxed{8}" not in text
+    assert cache.get(cache_key(dict(request, n=1))) is None
+    assert cache.get(cache_key(dict(request, n=1, stream_cutoff="answer")))["choices"][0]["message"]["content"] == text
+
+
+def test_cut_off_request_reuses_a_cached_full_completion(cache, server):
+    request = _request(server)
+    full = stream_completion(stop_at_answer=False, **request)
+    requests = server.requests
+    response = stream_completion(stop_at_answer=True, **request)
+    assert server.requests == requests
+    assert response.choices[0].message.content == full.choices[0].message.content
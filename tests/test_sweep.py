@@ -0,0 +1,32 @@
+import pytest
+
+from elis.sweep import DONE, FAILED, SKIPPED, Stage, run_graph
+
+
+def make_stage(tmp_path, name, resource="eval", deps=(), fail=False):
+    def run(stage):
+        if fail:
+            raise RuntimeError("boom")
+        with open(stage.output, "w") as f:
+            f.write(name)
+
+    return Stage(name, resource, str(tmp_path / f"{name}.txt"), run, {}, deps=deps)
+
+
+@pytest.mark.parametrize("concurrency, limits", [(0, {}), (2, {"eval": 0}), (2, {"hints": -1})])
+def test_limits_below_one_are_rejected(tmp_path, concurrency, limits):
+    with pytest.raises(ValueError):
+        run_graph([make_stage(tmp_path, "a")], concurrency, limits)
+
+
+def test_cyclic_dependencies_raise_instead_of_spinning(tmp_path):
+    stages = [make_stage(tmp_path, "a", deps=["b"]), make_stage(tmp_path, "b", deps=["a"])]
+    with pytest.raises(ValueError, match="cyclic"):
+        run_graph(stages)
+
+
+def test_failed_dependency_skips_downstream(tmp_path):
+    stages = [make_stage(tmp_path, "a", fail=True), make_stage(tmp_path, "b", deps=["a"]),
+              make_stage(tmp_path, "c", deps=["b"]), make_stage(tmp_path, "d", resource="hints")]
+    status = run_graph(stages, concurrency=2, limits={"eval": 1, "hints": 1})
+    assert status == {"a": FAILED, "b": SKIPPED, "c": SKIPPED, "d": DONE}